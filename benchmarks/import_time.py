@@ -0,0 +1,57 @@
+"""Measure how long it takes to import queue_fetcher.
+
+Run from the repository root:
+
+    python benchmarks/import_time.py [runs]
+
+Each import is timed in a fresh interpreter after Django is set up, and the
+median of the runs is reported alongside boto3 for comparison.
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TIMER = '''
+import time, django
+django.setup()
+start = time.time()
+import {module}
+print(time.time() - start)
+'''
+
+MODULES = [
+    'queue_fetcher.tasks',
+    'queue_fetcher.utils.sqs',
+    'queue_fetcher.test',
+    'boto3',
+]
+
+
+def time_import(module, runs):
+    """Return the median seconds to import module in a new interpreter.
+    """
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'test_project.settings')
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT, os.path.join(ROOT, 'test_project'), env.get('PYTHONPATH', '')])
+
+    timings = sorted(
+        float(subprocess.check_output(
+            [sys.executable, '-c', TIMER.format(module=module)], env=env))
+        for _ in range(runs))
+    return timings[len(timings) // 2]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for module in MODULES:
+        print('{:<28} {:8.1f} ms'.format(
+            module, time_import(module, runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
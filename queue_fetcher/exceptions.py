@@ -21,3 +21,17 @@ class MessageSendFailed(QueueFetcherException):
 class MessageProcessingError(QueueFetcherException):
     """Raised when a message could not be processed inside queue-fetcher.
     """
+
+
+class MessageDeferred(QueueFetcherException):
+    """Raised when a message should be retried later rather than failed.
+    """
+
+    def __init__(self, message, delay):
+        super(MessageDeferred, self).__init__(message)
+        self.delay = delay
+
+
+class MessageTimeout(MessageDeferred):
+    """Raised when a handler runs past its deadline.
+    """
@@ -0,0 +1,65 @@
+"""Export the messages on a queue to a JSON lines file.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+
+from django.core.management.base import BaseCommand
+
+from queue_fetcher.utils.sqs import thread_queue
+from queue_fetcher.utils.transfer import (Receiver, delete_batch, dump_record,
+                                          open_jsonl, resolve_queue,
+                                          to_record)
+
+
+class Command(BaseCommand):
+    """Save a queue's messages to disk with parallel receivers.
+    """
+
+    help = ('Export the messages on a queue to a JSON lines file')
+
+    def add_arguments(self, parser):
+        """Add the queue, file and tuning arguments.
+        """
+        parser.add_argument('queue', type=str,
+                            help='Queue name in QUEUES, SQS name or ARN')
+        parser.add_argument('file', type=str,
+                            help='File to append to, gzipped if it ends .gz')
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete messages once written, so an '
+                                 'interrupted export can be resumed')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of parallel receivers')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Most messages to export')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Most messages to export per second')
+        parser.add_argument('--visibility-timeout', type=int, default=300,
+                            help='Seconds to hide exported messages for - '
+                                 'without --delete, make this longer than '
+                                 'the export takes')
+
+    def handle(self, queue, file, delete=False, workers=4, limit=None,
+               rate=None, visibility_timeout=300,
+               *args, **kwargs):  # pylint: disable=W0613
+        """Handle the export_queue command.
+        """
+        queue = resolve_queue(queue)
+        lock = threading.Lock()
+
+        with open_jsonl(file, 'a') as fd:
+            def write(messages):
+                lines = ''.join(dump_record(to_record(message))
+                                for message in messages)
+                with lock:
+                    fd.write(lines)
+                    fd.flush()
+                if delete:
+                    delete_batch(thread_queue(queue), messages)
+
+            count = Receiver(queue, write, workers=workers, limit=limit,
+                             rate=rate,
+                             visibility_timeout=visibility_timeout,
+                             unique=not delete).run()
+
+        self.stdout.write('Exported {} messages'.format(count))
@@ -0,0 +1,70 @@
+"""Send the messages in a JSON lines file to a queue.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+
+from django.core.management.base import BaseCommand
+
+from queue_fetcher.utils.sqs import thread_queue
+from queue_fetcher.utils.transfer import (Progress, Throttle, batched,
+                                          read_records, resolve_queue,
+                                          run_threads, send_batch)
+
+
+class Command(BaseCommand):
+    """Load messages exported by export_queue onto a queue.
+    """
+
+    help = ('Send the messages in a JSON lines file to a queue')
+
+    def add_arguments(self, parser):
+        """Add the file, queue and tuning arguments.
+        """
+        parser.add_argument('file', type=str,
+                            help='File to read, gzipped if it ends .gz')
+        parser.add_argument('queue', type=str,
+                            help='Queue name in QUEUES, SQS name or ARN')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of parallel senders')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Most messages to send per second')
+        parser.add_argument('--progress', type=str, default=None,
+                            help='File to record progress in, so an '
+                                 'interrupted import can be resumed')
+
+    def handle(self, file, queue, workers=4, rate=None, progress=None,
+               *args, **kwargs):  # pylint: disable=W0613
+        """Handle the import_queue command.
+        """
+        queue = resolve_queue(queue)
+        progress = Progress(progress)
+        throttle = Throttle(rate)
+
+        start = progress.done
+        batches = batched(read_records(file, skip=start))
+        state = {'next': start}
+        lock = threading.Lock()
+
+        def next_batch():
+            with lock:
+                batch = next(batches, None)
+                index = state['next']
+                if batch is not None:
+                    state['next'] += len(batch)
+            return index, batch
+
+        def work():
+            target = thread_queue(queue)
+            while True:
+                index, batch = next_batch()
+                if batch is None:
+                    return
+                throttle.wait(len(batch))
+                send_batch(target, batch)
+                progress.finish(index, len(batch))
+
+        run_threads(workers, work)
+
+        self.stdout.write('Imported {} messages'.format(
+            progress.done - start))
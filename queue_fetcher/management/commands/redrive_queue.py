@@ -0,0 +1,52 @@
+"""Move every message from one queue to another.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from queue_fetcher.utils.sqs import thread_queue
+from queue_fetcher.utils.transfer import (Receiver, delete_batch,
+                                          resolve_queue, send_batch,
+                                          to_record)
+
+
+class Command(BaseCommand):
+    """Redrive a queue, such as a dead-letter queue, into another.
+    """
+
+    help = ('Move every message from one queue to another')
+
+    def add_arguments(self, parser):
+        """Add the queue and tuning arguments.
+        """
+        parser.add_argument('source', type=str,
+                            help='Queue to move messages from')
+        parser.add_argument('destination', type=str,
+                            help='Queue to move messages to')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of parallel receivers')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Most messages to move')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Most messages to move per second')
+        parser.add_argument('--visibility-timeout', type=int, default=300,
+                            help='Seconds to hide messages while moving them')
+
+    def handle(self, source, destination, workers=4, limit=None, rate=None,
+               visibility_timeout=300,
+               *args, **kwargs):  # pylint: disable=W0613
+        """Handle the redrive_queue command.
+        """
+        source = resolve_queue(source)
+        destination = resolve_queue(destination)
+
+        def move(messages):
+            send_batch(thread_queue(destination),
+                       [to_record(message) for message in messages])
+            delete_batch(thread_queue(source), messages)
+
+        count = Receiver(source, move, workers=workers, limit=limit,
+                         rate=rate,
+                         visibility_timeout=visibility_timeout).run()
+
+        self.stdout.write('Moved {} messages'.format(count))
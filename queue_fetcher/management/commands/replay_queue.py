@@ -0,0 +1,126 @@
+"""Replay captured messages through a queue task.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+from django.db import connection, transaction
+
+from queue_fetcher.exceptions import MessageDeferred
+from queue_fetcher.management.commands.run_queue import (
+    Command as RunQueueCommand)
+from queue_fetcher.utils.attributes import decode_attributes
+from queue_fetcher.utils.tracing import StatsTracer
+from queue_fetcher.utils.transfer import (Throttle, read_records,
+                                          run_threads)
+
+
+class _Rollback(Exception):
+    """Raised to roll back a dry run.
+    """
+
+
+class Command(RunQueueCommand):
+    """Feed messages from a file to a task's handlers without SQS.
+    """
+
+    help = ('Replay captured messages through a queue task')
+
+    def add_arguments(self, parser):
+        """Add the task, file and tuning arguments.
+        """
+        parser.add_argument('task', type=str, help='Task to run')
+        parser.add_argument('file', type=str,
+                            help='JSON lines file from export_queue, '
+                                 'gzipped if it ends .gz')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of parallel workers')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Most messages to replay per second')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Most messages to replay')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Roll back every message after processing')
+
+    def replay(self, task, record, dry_run):
+        """Read one record, returning whether it was processed.
+        """
+        if isinstance(record, dict) and 'body' in record:
+            body = record['body']
+            attributes = decode_attributes(record.get('message_attributes'))
+        else:
+            body, attributes = record, None
+
+        try:
+            with transaction.atomic():
+                processed = task._read(body, attributes)
+                if dry_run:
+                    raise _Rollback()
+        except _Rollback:
+            pass
+        except MessageDeferred as ex:
+            self.stderr.write('Message deferred: {}'.format(ex))
+            return False
+        except Exception as ex:  # pylint: disable=W0703
+            self.stderr.write('Message failed: {!r}'.format(ex))
+            return False
+        return processed
+
+    def handle(self, task, file, workers=1, rate=None, limit=None,
+               dry_run=False, *args, **kwargs):  # pylint: disable=W0613
+        """Handle the replay_queue command.
+        """
+        task = self.get_task_class(task)()
+        task.tracer = stats = StatsTracer()
+        throttle = Throttle(rate)
+
+        records = read_records(file)
+        lock = threading.Lock()
+        totals = {'messages': 0, 'failed': 0}
+
+        def next_record():
+            with lock:
+                if limit is not None and totals['messages'] >= limit:
+                    return None
+                record = next(records, None)
+                if record is not None:
+                    totals['messages'] += 1
+                return record
+
+        def work():
+            try:
+                while True:
+                    record = next_record()
+                    if record is None:
+                        return
+                    throttle.wait()
+                    if not self.replay(task, record, dry_run):
+                        with lock:
+                            totals['failed'] += 1
+            finally:
+                if workers > 1:
+                    connection.close()
+
+        start = time.time()
+        if workers > 1:
+            run_threads(workers, work)
+        else:
+            work()
+        self.report(stats, totals, time.time() - start)
+
+    def report(self, stats, totals, elapsed):
+        """Write the throughput, failures and timings.
+        """
+        self.stdout.write('{:<30} {:>8} {:>8} {:>10} {:>10}'.format(
+            'handler', 'count', 'failed', 'mean ms', 'per sec'))
+        for name in sorted(stats.stats):
+            count, errors, total = stats.stats[name]
+            self.stdout.write('{:<30} {:>8} {:>8} {:>10.2f} {:>10.1f}'.format(
+                name, count, errors, total * 1000 / count,
+                count / total if total else 0))
+
+        self.stdout.write(
+            'Replayed {} messages, {} failed, in {:.2f}s ({:.1f}/s)'.format(
+                totals['messages'], totals['failed'], elapsed,
+                totals['messages'] / elapsed if elapsed else 0))
@@ -22,10 +22,14 @@ class Command(BaseCommand):
         config = apps.get_app_config(app_name)
         return config.module
 
-    def handle(self, task, *args, **kwargs):  # pylint: disable=W0613
-        """Handle the run_queue command.
+    def get_task_class(self, task):
+        """Return the task class from its `app_label.TaskName`.
         """
         app_label, task = task.split('.')
-        task = import_string('{}.tasks.{}'.format(
+        return import_string('{}.tasks.{}'.format(
             self.get_app_module(app_label).__name__, task))
-        task().run()
+
+    def handle(self, task, *args, **kwargs):  # pylint: disable=W0613
+        """Handle the run_queue command.
+        """
+        self.get_task_class(task)().run()
@@ -1 +1,2 @@
 from queue_fetcher.tasks.base import QueueFetcher
+from queue_fetcher.tasks.multi import MultiQueueFetcher
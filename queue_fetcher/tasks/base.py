@@ -4,6 +4,12 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import logging
 import json
+import math
+import signal
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 
 import six
@@ -12,8 +18,15 @@ from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.db import transaction
 
-from queue_fetcher.exceptions import MessageProcessingError
+from queue_fetcher.exceptions import (MessageDeferred, MessageProcessingError,
+                                      MessageTimeout)
 from queue_fetcher.utils import sqs
+from queue_fetcher.utils.attributes import decode_attributes
+from queue_fetcher.utils.breaker import CircuitBreaker
+from queue_fetcher.utils.process import get_rss
+from queue_fetcher.utils.ratelimit import RateLimit
+from queue_fetcher.utils.stream import chunked, iter_json_array
+from queue_fetcher.utils.tracing import get_tracer
 
 
 # Max number of messages to work on in a cycle - 10 is the maximum supported
@@ -38,11 +51,61 @@ class QueueFetcher(object):
     queue = None
     region = 'eu-west-1'
     visibility_timeout = None
+    # Tracer to use instead of the one set by QUEUE_FETCHER_TRACER
+    tracer = None
+    # message_type: dict of `rate`, `burst` and `concurrency` limits
+    rate_limits = {}
+    # Django cache alias to share rate_limits between processes
+    rate_limit_cache = None
+    # Seconds to hide a message that is over its rate limit
+    rate_limit_delay = 30
+    # Action for messages whose message_types all have no handler: `None` to
+    # decode and fail them, 'skip' to delete them or 'defer' to hide them for
+    # unhandled_delay seconds so another consumer can take them
+    unhandled_action = None
+    unhandled_delay = 30
+    # Decode list messages incrementally, stream_chunk_size events at a time
+    stream_decode = False
+    stream_chunk_size = 100
+    # Commit each chunk separately - a failure part way through a message
+    # leaves the earlier chunks committed, so handlers must be idempotent
+    stream_commit_chunks = False
+    # Stop run() after this many messages, bytes of resident memory or
+    # seconds so a leaky worker can be restarted cleanly
+    max_messages = None
+    max_rss = None
+    max_lifetime = None
+    # Seconds a process_ method may run for, by message_type, and otherwise
+    default_deadline = None
+    deadlines = {}
+    # Seconds to hide a message that timed out before it is retried
+    timeout_retry_delay = 0
+    # Stop receiving while messages fail systematically - a dict of
+    # CircuitBreaker options such as failure_rate, min_calls and reset_timeout
+    circuit_breaker = None
+    # Also break each message_type separately, deferring its messages
+    circuit_breaker_per_type = False
+    # message_type: dict of `max_age` in seconds and the `action` for older
+    # messages - 'drop' to discard them, 'park' to send them to park_queue or
+    # 'stale' to call process_stale_<message_type> instead
+    stale_policies = {}
+    # Internal name in settings.QUEUES to send parked messages to
+    park_queue = None
 
     def __init__(self):
         """Setup internal variables.
         """
         self._queue = None
+        self._park_queue = None
+        self._rate_limiters = {}
+        self._breakers = {}
+        self._type_breakers = {}
+        self._message_count = 0
+        self._started = None
+        # Per-thread handler state, such as the current deadline
+        self._local = threading.local()
+        # Count of handler timeouts by message_type
+        self.timeouts = Counter()
 
     def get_queue(self):
         """Return the queue.
@@ -54,19 +117,59 @@ class QueueFetcher(object):
         """
         return self.region
 
+    def get_tracer(self):
+        """Return the tracer used to time each message.
+        """
+        if self.tracer is not None:
+            return self.tracer
+        return get_tracer()
+
     def run(self):
         """Poll the messaging queue for any messages and asks the implementer
         to deal with them.
+
+        Returns once a `max_messages`, `max_rss` or `max_lifetime` limit is
+        reached, after finishing the current batch, so the worker can be
+        restarted by its supervisor.
         """
         self._prerun()
+        self._started = time.time()
 
         while True:
             self._run()
 
+            reason = self._recycle_reason()
+            if reason is not None:
+                logger.info('Stopping worker to be recycled: %s', reason)
+                return
+
+    def _recycle_reason(self):
+        """Return why the worker should stop, or `None` to keep running.
+        """
+        if (self.max_messages is not None and
+                self._message_count >= self.max_messages):
+            return 'processed {} messages'.format(self._message_count)
+
+        if self.max_lifetime is not None:
+            lifetime = time.time() - self._started
+            if lifetime >= self.max_lifetime:
+                return 'running for {:.0f} seconds'.format(lifetime)
+
+        if self.max_rss is not None:
+            rss = get_rss()
+            if rss is not None and rss >= self.max_rss:
+                return 'using {} bytes of memory'.format(rss)
+
+        return None
+
     def _prerun(self):
         """Setup the QueueFetcher for getting messages from SQS.
         """
-        queue_key = self._get_queue()
+        self._queue = self._lookup_queue(self._get_queue())
+
+    def _lookup_queue(self, queue_key):
+        """Return the SQS queue for the internal name in settings.QUEUES.
+        """
         if not hasattr(settings, 'QUEUES'):
             raise ImproperlyConfigured(QUEUES_NOT_SETUP)
 
@@ -74,7 +177,7 @@ class QueueFetcher(object):
 
         logger.info('Polling %s for messages', queue_name)
 
-        self._queue = sqs.get_queue(queue_name, self.get_region())
+        return sqs.get_queue(queue_name, self.get_region())
 
     def run_once(self):
         """Run the queue fetcher just once.
@@ -93,24 +196,248 @@ class QueueFetcher(object):
     def _run(self):
         """Do the actual queue_fetcher execution.
         """
+        messages = self._receive(self._queue, WAIT_TIME)
+        self._process_messages(messages, self._queue)
+
+    def _receive(self, queue, wait_time, batch_size=BATCH_SIZE):
+        """Receive a batch of messages from the given queue.
+
+        While the queue's circuit breaker is open this waits for up to
+        `wait_time` seconds and returns nothing. While it is half-open only a
+        small probe batch is received.
+        """
+        breaker = self._get_breaker(queue)
+        if breaker is not None:
+            state = breaker.state
+            if state == CircuitBreaker.OPEN:
+                time.sleep(min(wait_time, breaker.retry_in()))
+                return []
+            elif state == CircuitBreaker.HALF_OPEN:
+                batch_size = min(batch_size, breaker.probe_size)
+
+        kwargs = {
+            'MaxNumberOfMessages': batch_size,
+            'WaitTimeSeconds': wait_time,
+            'MessageAttributeNames': ['All'],
+            'AttributeNames': ['SentTimestamp'],
+        }
         if self.visibility_timeout:
-            messages = self._queue.receive_messages(
-                MaxNumberOfMessages=BATCH_SIZE,
-                WaitTimeSeconds=WAIT_TIME,
-                VisibilityTimeout=self.visibility_timeout)
-        else:
-            messages = self._queue.receive_messages(
-                MaxNumberOfMessages=BATCH_SIZE,
-                WaitTimeSeconds=WAIT_TIME)
+            kwargs['VisibilityTimeout'] = self.visibility_timeout
+
+        return queue.receive_messages(**kwargs)
+
+    def _process_messages(self, messages, queue=None):
+        """Read each received message, deleting the ones we processed.
+        """
+        breaker = self._get_breaker(queue)
 
         if len(messages):
             logger.info('%s Received %d messages',
                         datetime.now().isoformat(),
                         len(messages))
+            self._message_count += len(messages)
 
             for message in messages:
-                if self.read(message.body):
-                    message.delete()
+                outcome = self._handle_message(message, queue)
+                if breaker is not None and outcome in (
+                        'processed', 'failed', 'timeout'):
+                    breaker.record(outcome == 'processed')
+
+    def _get_breaker(self, queue):
+        """Return the circuit breaker for the queue, or `None`.
+        """
+        if self.circuit_breaker is None or queue is None:
+            return None
+
+        if queue not in self._breakers:
+            self._breakers[queue] = CircuitBreaker(
+                six.text_type(queue), **self.circuit_breaker)
+        return self._breakers[queue]
+
+    def _get_type_breaker(self, message_type):
+        """Return the circuit breaker for the message type, or `None`.
+        """
+        if self.circuit_breaker is None or not self.circuit_breaker_per_type:
+            return None
+
+        if message_type not in self._type_breakers:
+            self._type_breakers[message_type] = CircuitBreaker(
+                message_type, **self.circuit_breaker)
+        return self._type_breakers[message_type]
+
+    def _handle_message(self, message, queue=None):
+        """Read a received message, then delete or defer it.
+
+        :param queue: The queue the message was received from
+        :returns: What happened to the message - one of `'delayed'`,
+            `'skipped'`, `'deferred'`, `'stale'`, `'timeout'`, `'processed'`
+            or `'failed'`
+        """
+        attributes = decode_attributes(
+            getattr(message, 'message_attributes', None))
+
+        if self._delay(message, attributes, queue):
+            return 'delayed'
+        age = self._message_age(message) if self.stale_policies else None
+
+        action = self.route(attributes)
+        if action == 'skip':
+            logger.info('Skipping message of type %s',
+                        attributes['message_type'])
+            message.delete()
+            return 'skipped'
+        elif action == 'defer':
+            self._defer(message, self.unhandled_delay)
+            return 'deferred'
+
+        if self._shed(message, attributes, age):
+            return 'stale'
+
+        try:
+            processed = self._read(message.body, attributes, age)
+        except MessageTimeout as ex:
+            self._defer(message, ex.delay)
+            return 'timeout'
+        except MessageDeferred as ex:
+            self._defer(message, ex.delay)
+            return 'deferred'
+
+        if processed:
+            message.delete()
+            return 'processed'
+        return 'failed'
+
+    def _delay(self, message, attributes, queue):
+        """Put back a message sent with a delay longer than SQS supports.
+
+        :returns: `True` if the message is not due yet
+        """
+        deliver_at = attributes.get('deliver_at')
+        if deliver_at is None:
+            return False
+
+        remaining = deliver_at - time.time()
+        if remaining <= 0:
+            return False
+
+        if queue is None:
+            # SQS allows a message to be hidden for up to 12 hours
+            self._defer(message, min(remaining, 43200))
+        else:
+            forward = dict(attributes)
+            del forward['deliver_at']
+            sqs.send_message(queue, message.body, attributes=forward,
+                             delay=remaining)
+            message.delete()
+        return True
+
+    def _message_age(self, message):
+        """Return the seconds since the message was sent, or `None`.
+        """
+        try:
+            sent = int(message.attributes['SentTimestamp']) / 1000.0
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        return max(0, time.time() - sent)
+
+    def _stale_action(self, message_type, age):
+        """Return the stale_policies action if the message is too old.
+        """
+        policy = self.stale_policies.get(message_type)
+        if policy is None or age is None or age <= policy['max_age']:
+            return None
+        return policy['action']
+
+    def _shed(self, message, attributes, age):
+        """Drop or park a stale message without decoding it.
+
+        This only happens when the message_type attribute shows every event
+        in the message should be dropped, or every one parked.
+
+        :returns: `True` if the message was shed
+        """
+        types = attributes.get('message_type')
+        if age is None or not types:
+            return False
+
+        actions = set(self._stale_action(message_type, age)
+                      for message_type in types.split(','))
+        if len(actions) != 1:
+            return False
+
+        action = actions.pop()
+        if action == 'drop':
+            logger.info('Dropping stale message of type %s', types)
+        elif action == 'park':
+            logger.info('Parking stale message of type %s', types)
+            self._park(message.body, attributes)
+        else:
+            return False
+
+        message.delete()
+        return True
+
+    def _park(self, message, attributes=None):
+        """Send a stale message to the park_queue.
+        """
+        if self.park_queue is None:
+            raise ImproperlyConfigured('QueueFetcher.park_queue is not set')
+
+        if self._park_queue is None:
+            self._park_queue = sqs.get_queue(
+                settings.QUEUES[self.park_queue], self.get_region())
+        sqs.send_message(sqs.thread_queue(self._park_queue), message,
+                         attributes=attributes)
+
+    def _park_on_commit(self, event):
+        """Park a stale event once the message's transaction commits.
+
+        The events parked while reading a message are sent together, and not
+        at all if the message is rolled back.
+        """
+        parked = getattr(self._local, 'parked', None)
+        if parked is None:
+            self._local.parked = [event]
+            transaction.on_commit(self._park_events)
+        else:
+            parked.append(event)
+
+    def _park_events(self):
+        """Send the events parked by the committed transaction.
+        """
+        parked, self._local.parked = self._local.parked, None
+        self._park(parked)
+
+    def route(self, attributes):
+        """Decide what to do with a message from its attributes alone.
+
+        This runs before the message body is decoded. A message is only
+        skipped or deferred when none of its types have a handler - one we
+        can partly handle is processed, and fails on its unhandled events.
+
+        :returns: `None` to process the message, `'skip'` to delete it or
+            `'defer'` to release it for another consumer
+        """
+        types = attributes.get('message_type')
+        if not types or self.unhandled_action is None:
+            return None
+
+        for message_type in types.split(','):
+            if self._get_handler(message_type) is not None:
+                return None
+        return self.unhandled_action
+
+    def _get_handler(self, message_type):
+        """Return the process_ method for the message type, or `None`.
+        """
+        return getattr(self, 'process_{}'.format(message_type), None)
+
+    def _defer(self, message, delay):
+        """Hide the message from receivers for `delay` seconds.
+        """
+        delay = int(math.ceil(delay))
+        logger.info('Deferring message for %ds', delay)
+        message.change_visibility(VisibilityTimeout=delay)
 
     def read(self, q_message):
         """Process a raw message from Amazon SQS.
@@ -119,24 +446,262 @@ class QueueFetcher(object):
 
         :returns: `True` if successful, otherwise `False`
         """
-        rsp = False
         try:
-            # Each iteration of the queue-fetcher should be all-or-nothing.
-            with transaction.atomic():
+            return self._read(q_message)
+        except MessageDeferred as ex:
+            logger.info(six.text_type(ex))
+            return False
+
+    def _read(self, q_message, attributes=None, age=None):
+        """Process a raw message, raising `MessageDeferred` to retry later.
+
+        :param attributes: The decoded SQS message attributes, if any
+        :param age: Seconds since the message was sent, if known
+        """
+        self._local.age = age
+        try:
+            return self._read_message(q_message, attributes)
+        finally:
+            self._local.age = None
+            self._local.batch_cache = {}
+            self._local.parked = None
+
+    def _read_message(self, q_message, attributes):
+        """Decode and process a raw message inside its transaction.
+        """
+        rsp = False
+        span_attributes = {'task': self.__class__.__name__}
+        with self.get_tracer().span('read', parent=attributes,
+                                    attributes=span_attributes) as span:
+            try:
                 if isinstance(q_message, six.binary_type):
                     q_message = q_message.decode('utf-8')
-                if isinstance(q_message, six.text_type):
-                    q_message = json.loads(q_message)
 
-                self.process(q_message)
+                if (self.stream_decode and
+                        isinstance(q_message, six.text_type)):
+                    self._read_stream(q_message)
+                else:
+                    # Each iteration of the queue-fetcher should be
+                    # all-or-nothing.
+                    with transaction.atomic():
+                        if isinstance(q_message, six.text_type):
+                            q_message = json.loads(q_message)
+
+                        with self._limit(q_message):
+                            self._prefetch(q_message)
+                            self.process(q_message)
+
+            except MessageProcessingError as ex:
+                logger.error(six.text_type(ex))
+                logger.info('Message could not be processed')
+                span.set_attribute('error', six.text_type(ex))
+            else:
+                rsp = True
 
-        except MessageProcessingError as ex:
-            logger.error(six.text_type(ex))
-            logger.info('Message could not be processed')
+        return rsp
+
+    def _read_stream(self, q_message):
+        """Process a JSON list message while it is being decoded.
+
+        Events are decoded and processed `stream_chunk_size` at a time. Unless
+        `stream_commit_chunks` is set, the whole message is still processed in
+        one transaction.
+        """
+        chunks = chunked(iter_json_array(q_message), self.stream_chunk_size)
+
+        if self.stream_commit_chunks:
+            for chunk in chunks:
+                with transaction.atomic():
+                    with self._limit(chunk):
+                        self._prefetch(chunk)
+                        self.process(chunk)
         else:
-            rsp = True
+            with transaction.atomic():
+                for chunk in chunks:
+                    with self._limit(chunk):
+                        self._prefetch(chunk)
+                        self.process(chunk)
 
-        return rsp
+    @property
+    def batch_cache(self):
+        """Return a dict handlers can share while reading one message.
+
+        It is emptied once the message's transaction is over. Fill it in
+        `prefetch` to load related rows for every event at once.
+        """
+        if not hasattr(self._local, 'batch_cache'):
+            self._local.batch_cache = {}
+        return self._local.batch_cache
+
+    def prefetch(self, events):
+        """Load anything the handlers need for these events in bulk.
+
+        This is called once for each message, or each chunk when
+        `stream_decode` is set, inside its transaction and before any of its
+        events are processed. Store the results in `batch_cache`.
+
+        :type events: list
+        :param events: The decoded events about to be processed
+        """
+
+    def _prefetch(self, msg):
+        """Call prefetch with the message's events as a list.
+        """
+        self.prefetch(list(msg) if isinstance(msg, (list, tuple)) else [msg])
+
+    def _message_types(self, msg):
+        """Return the message_type of every event in the message.
+        """
+        if isinstance(msg, (list, tuple)):
+            types = []
+            for message_item in msg:
+                types.extend(self._message_types(message_item))
+            return types
+
+        try:
+            return [msg['message_type']]
+        except (KeyError, TypeError):
+            return []
+
+    def _get_rate_limit(self, message_type):
+        """Return the RateLimit for the message type, or `None`.
+        """
+        config = self.rate_limits.get(message_type)
+        if config is None:
+            return None
+
+        if message_type not in self._rate_limiters:
+            config = dict(config)
+            config.setdefault('cache', self.rate_limit_cache)
+            # A message can't be held for longer than it stays hidden, or
+            # than its deadline
+            timeouts = [timeout for timeout in (
+                self.visibility_timeout, self.get_deadline(message_type))
+                if timeout]
+            if timeouts:
+                config.setdefault('lease_timeout',
+                                  int(math.ceil(max(timeouts))))
+            self._rate_limiters[message_type] = RateLimit(
+                '{}:{}'.format(self.__class__.__name__, message_type),
+                **config)
+        return self._rate_limiters[message_type]
+
+    @contextmanager
+    def _limit(self, msg):
+        """Check the circuit breakers and hold the rate and concurrency limits
+        for the message's events.
+
+        Each type's breaker records one result for the message - a failure
+        for the type whose handler failed, otherwise a success for every type.
+        """
+        held = []
+        breakers = {}
+        counts = Counter(self._message_types(msg))
+
+        for message_type in sorted(counts):
+            breaker = self._get_type_breaker(message_type)
+            if breaker is None:
+                continue
+            if not breaker.allow():
+                raise MessageDeferred(
+                    'Circuit for message type {} is open'.format(
+                        message_type),
+                    breaker.retry_in())
+            breakers[message_type] = breaker
+
+        self._local.failed_type = None
+        try:
+            for message_type in sorted(counts):
+                limit = self._get_rate_limit(message_type)
+                if limit is None:
+                    continue
+                lease = limit.acquire(counts[message_type])
+                if lease is None:
+                    # Hand back what the earlier types took
+                    for held_type, held_limit, held_lease in held:
+                        held_limit.cancel(held_lease, counts[held_type])
+                    held = []
+                    raise MessageDeferred(
+                        'Message type {} is over its rate limit'.format(
+                            message_type),
+                        self.rate_limit_delay)
+                held.append((message_type, limit, lease))
+
+            try:
+                yield
+            except Exception:
+                failed = breakers.get(self._local.failed_type)
+                if failed is not None:
+                    failed.record(False)
+                raise
+            for breaker in breakers.values():
+                breaker.record(True)
+        finally:
+            self._local.failed_type = None
+            for _, limit, lease in held:
+                limit.release(lease)
+
+    def get_deadline(self, message_type):
+        """Return the seconds a message type may be handled for, or `None`.
+        """
+        return self.deadlines.get(message_type, self.default_deadline)
+
+    def check_deadline(self):
+        """Raise `MessageTimeout` if the current handler is past its deadline.
+
+        Long-running handlers can call this between steps. It is also checked
+        after each handler returns.
+        """
+        deadline_at = getattr(self._local, 'deadline_at', None)
+        if deadline_at is not None and time.time() > deadline_at:
+            raise MessageTimeout('Handler ran past its deadline',
+                                 self.timeout_retry_delay)
+
+    @contextmanager
+    def _deadline(self, message_type):
+        """Interrupt the handler if it runs past its deadline.
+
+        In the main thread on Unix the handler is interrupted with SIGALRM.
+        Python code, including reads on Python sockets, is interrupted, but
+        C extensions that block without returning to Python, such as libpq,
+        are not. Elsewhere the deadline is only enforced by `check_deadline`.
+        """
+        seconds = self.get_deadline(message_type)
+        if seconds is None:
+            yield
+            return
+
+        def on_alarm(signum, frame):  # pylint: disable=W0613
+            raise MessageTimeout(
+                'Message type {} ran past its {}s deadline'.format(
+                    message_type, seconds),
+                self.timeout_retry_delay)
+
+        use_alarm = (hasattr(signal, 'setitimer') and
+                     threading.current_thread().name == 'MainThread')
+        if use_alarm:
+            previous = signal.signal(signal.SIGALRM, on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, seconds)
+
+        self._local.deadline_at = time.time() + seconds
+        try:
+            try:
+                yield
+            finally:
+                # Stop the timer before anything else, so it can't go off
+                # once the handler is done
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            self.check_deadline()
+        except MessageTimeout:
+            self.timeouts[message_type] += 1
+            logger.warning('Message type %s timed out after %ss',
+                           message_type, seconds)
+            raise
+        finally:
+            self._local.deadline_at = None
+            if use_alarm:
+                signal.signal(signal.SIGALRM, previous)
 
     def process(self, msg):
         """Process the message passed in
@@ -157,9 +722,32 @@ class QueueFetcher(object):
                     'Message did not have a message_type {}'.format(
                         six.text_type(msg)))
 
-            process = getattr(self, 'process_{}'.format(message_type), None)
+            handler_name = 'process_{}'.format(message_type)
+
+            action = self._stale_action(message_type,
+                                        getattr(self._local, 'age', None))
+            if action == 'drop':
+                logger.debug('Dropping stale %s event', message_type)
+                return
+            elif action == 'park':
+                logger.debug('Parking stale %s event', message_type)
+                self._park_on_commit(msg)
+                return
+            elif action == 'stale' and hasattr(
+                    self, 'process_stale_{}'.format(message_type)):
+                handler_name = 'process_stale_{}'.format(message_type)
+
+            process = getattr(self, handler_name, None)
             if process is not None:
-                process(msg)
+                try:
+                    with self.get_tracer().span(handler_name):
+                        with self._deadline(message_type):
+                            process(msg)
+                except Exception:
+                    # Blame the first type to fail for the circuit breaker
+                    if getattr(self._local, 'failed_type', None) is None:
+                        self._local.failed_type = message_type
+                    raise
             else:
                 logger.warning('Message type %s not handled. You may need to '
                                'write process_%s.',
@@ -0,0 +1,128 @@
+"""Consume several SQS queues from a single worker process.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+
+from queue_fetcher.tasks.base import QueueFetcher, WAIT_TIME
+
+
+logger = logging.getLogger(__name__)
+
+
+class _QueueState(object):
+    """Scheduling state for one queue polled by a MultiQueueFetcher.
+    """
+
+    def __init__(self, key, queue, weight):
+        self.key = key
+        self.queue = queue
+        self.weight = weight
+        self.current_weight = 0
+        self.backoff = 0
+        self.next_poll = 0
+
+    def is_ready(self, now):
+        """Return whether this queue is due to be polled.
+        """
+        return self.next_poll <= now
+
+
+class MultiQueueFetcher(QueueFetcher):
+    """Poll several queues from one process, sharing the same handlers.
+
+    Set `queues` to a dict of `internal name`: `weight`. Queues are picked
+    with smooth weighted round-robin, so a queue with weight 3 is polled three
+    times as often as one with weight 1 while every queue is still polled
+    within each round. A queue that returns no messages is backed off,
+    doubling from `idle_backoff` up to `max_idle_backoff` seconds, and is
+    polled again as soon as it yields messages.
+    """
+
+    queues = None
+    idle_backoff = 1
+    max_idle_backoff = 60
+
+    def __init__(self):
+        """Setup internal variables.
+        """
+        super(MultiQueueFetcher, self).__init__()
+        self._states = []
+
+    def get_queues(self):
+        """Return the dict of queue names to weights.
+        """
+        return self.queues
+
+    def _prerun(self):
+        """Look up every queue we are going to poll.
+        """
+        queues = self.get_queues()
+        if not queues:
+            raise ImproperlyConfigured('MultiQueueFetcher.queues is not set')
+
+        self._states = []
+        for key in sorted(queues):
+            weight = queues[key]
+            if weight <= 0:
+                raise ImproperlyConfigured(
+                    'Queue {} must have a positive weight'.format(key))
+            self._states.append(
+                _QueueState(key, self._lookup_queue(key), weight))
+
+    def _next_state(self, now):
+        """Return the next ready queue state, or `None` if all are idle.
+        """
+        ready = [state for state in self._states if state.is_ready(now)]
+        if not ready:
+            return None
+
+        total = 0
+        for state in ready:
+            state.current_weight += state.weight
+            total += state.weight
+
+        chosen = max(ready, key=lambda state: state.current_weight)
+        chosen.current_weight -= total
+        return chosen
+
+    def _wait_time(self, chosen, now):
+        """Long-poll the chosen queue until another queue becomes due.
+        """
+        others = [state.next_poll - now for state in self._states
+                  if state is not chosen and not state.is_ready(now)]
+        if len(others) + 1 < len(self._states):
+            # Another queue is ready right now - don't hold it up.
+            return 0
+        if not others:
+            return WAIT_TIME
+        return max(0, min(WAIT_TIME, int(min(others))))
+
+    def _run(self):
+        """Poll the next queue due, or sleep until one is.
+        """
+        now = time.time()
+        state = self._next_state(now)
+
+        if state is None:
+            delay = min(s.next_poll for s in self._states) - now
+            time.sleep(max(0, delay))
+            return
+
+        messages = self._receive(state.queue, self._wait_time(state, now))
+
+        if len(messages):
+            state.backoff = 0
+            state.next_poll = 0
+        else:
+            state.backoff = min(
+                self.max_idle_backoff,
+                state.backoff * 2 if state.backoff else self.idle_backoff)
+            state.next_poll = time.time() + state.backoff
+            logger.debug('Queue %s idle, backing off for %ss',
+                         state.key, state.backoff)
+
+        self._process_messages(messages, state.queue)
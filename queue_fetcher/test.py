@@ -1,6 +1,7 @@
 """Helper test classes for your SQS integrations.
 """
-from os.path import join
+from os.path import getmtime, join
+import copy
 import json
 
 import logging
@@ -8,37 +9,126 @@ import logging
 from django.test import TestCase
 from django.conf import settings
 
+from queue_fetcher.utils import sqs
+from queue_fetcher.utils.attributes import message_types
+
 logger = logging.getLogger(__name__)
 
+# Parsed fixtures keyed by (parser, path, modification time)
+_FIXTURES = {}
+
+
+def _yaml_load(text):
+    """Parse YAML with the C loader if pyYAML was built with it.
+    """
+    try:
+        import yaml
+    except ImportError:
+        logger.warning('pyYAML not installed - YAML is not supported')
+        raise
+
+    return yaml.load(text, Loader=getattr(yaml, 'CLoader', yaml.Loader))
+
 
 class QueueTestCase(TestCase):
     """Provides helper methods to make it easier to test tasks without SQS.
+
+    The test outbox and mock queues are emptied around each test, so tests
+    don't see each other's messages.
     """
 
+    def setUp(self):
+        """Start each test with an empty outbox and queues.
+        """
+        super(QueueTestCase, self).setUp()
+        sqs.clear_outbox()
+        sqs.clear_queues()
+        self.addCleanup(sqs.clear_queues)
+        self.addCleanup(sqs.clear_outbox)
+
     def get_yaml(self, name):
         """Return the SQS fixture parsed from YAML.
         """
-        try:
-            import yaml
-        except ImportError:
-            logger.warning('pyYAML not installed - YAML is not supported')
-
-        return yaml.load(self.get_fixture(name))
+        return self._get_parsed(name, _yaml_load)
 
     def get_json(self, name):
         """Return the SQS fixture parsed from JSON.
         """
-        return json.loads(self.get_fixture(name))
+        return self._get_parsed(name, json.loads)
 
-    def get_fixture(self, name):
-        """Retrieve the specified fixture.
+    def _get_parsed(self, name, parse):
+        """Return a copy of the fixture parsed once per modification.
+        """
+        path = self._get_fixture_path(name)
+        key = (parse.__name__, path, getmtime(path))
+        if key not in _FIXTURES:
+            _FIXTURES[key] = parse(self.get_fixture(name))
+        return copy.deepcopy(_FIXTURES[key])
+
+    def _get_fixture_path(self, name):
+        """Return the path to the named fixture.
         """
         parts = name.split('/')
-        path = join(settings.BASE_DIR,
+        return join(settings.BASE_DIR,
                     parts[0],
                     'fixtures',
                     parts[0],
                     *parts[1:])
 
-        with open(path) as fd:
+    def get_fixture(self, name):
+        """Retrieve the specified fixture.
+        """
+        with open(self._get_fixture_path(name)) as fd:
             return fd.read()
+
+    def get_outbox(self, queue):
+        """Return the messages sent to a queue in this test.
+
+        :param queue: Internal name in QUEUES, or the SQS queue name
+        """
+        name = getattr(settings, 'QUEUES', {}).get(queue, queue)
+        return sqs.outbox.get(name, [])
+
+    def add_message(self, queue, msg, attributes=None):
+        """Put a message on a mock queue for a task to receive.
+        """
+        name = getattr(settings, 'QUEUES', {}).get(queue, queue)
+        sqs.get_queue(name).add_message(msg, attributes)
+
+    def assertMessageSent(self, queue, message=None, message_type=None,
+                          count=None):
+        """Assert messages were sent to a queue.
+
+        :param message: A message that must have been sent
+        :param message_type: A message_type at least one event must have
+        :param count: The exact number of messages sent
+        """
+        outbox = self.get_outbox(queue)
+
+        if count is not None:
+            self.assertEqual(len(outbox), count,
+                             '{} messages sent to {}, expected {}'.format(
+                                 len(outbox), queue, count))
+        else:
+            self.assertTrue(outbox, 'No messages sent to {}'.format(queue))
+
+        if message is not None:
+            self.assertIn(message, outbox)
+
+        if message_type is not None:
+            types = set()
+            for sent in outbox:
+                types.update(message_types(sent))
+            self.assertIn(message_type, types,
+                          'No {} message sent to {}'.format(message_type,
+                                                            queue))
+
+    def assertNoMessagesSent(self, queue=None):
+        """Assert nothing was sent to the queue, or to any queue.
+        """
+        if queue is None:
+            sent = dict((name, messages)
+                        for name, messages in sqs.outbox.items() if messages)
+        else:
+            sent = self.get_outbox(queue)
+        self.assertFalse(sent, 'Messages were sent: {}'.format(sent))
@@ -0,0 +1,84 @@
+"""Convert between plain dicts and SQS MessageAttributes.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import numbers
+
+import six
+
+
+logger = logging.getLogger(__name__)
+
+# SQS rejects messages with more than 10 attributes
+MAX_ATTRIBUTES = 10
+
+
+def message_types(message, types=None):
+    """Return the distinct message_types in a message, in order of appearance.
+
+    Nested lists are searched the same way `QueueFetcher.process` walks them.
+    """
+    if types is None:
+        types = []
+
+    if isinstance(message, (list, tuple)):
+        for item in message:
+            message_types(item, types)
+        return types
+
+    try:
+        message_type = message['message_type']
+    except (KeyError, TypeError):
+        return types
+    if message_type not in types:
+        types.append(message_type)
+    return types
+
+
+def encode_attributes(attributes):
+    """Return the SQS MessageAttributes for a dict of plain values.
+    """
+    if len(attributes) > MAX_ATTRIBUTES:
+        raise ValueError('SQS supports at most {} message attributes'.format(
+            MAX_ATTRIBUTES))
+
+    encoded = {}
+    for key, value in attributes.items():
+        if isinstance(value, bool) or not isinstance(value, numbers.Number):
+            encoded[key] = {'DataType': 'String',
+                            'StringValue': six.text_type(value)}
+        else:
+            encoded[key] = {'DataType': 'Number',
+                            'StringValue': six.text_type(value)}
+    return encoded
+
+
+def _decode_number(number):
+    """Return an SQS Number attribute as an int, or a float if it has a
+    fraction or exponent.
+    """
+    try:
+        return int(number)
+    except ValueError:
+        return float(number)
+
+
+def decode_attributes(message_attributes):
+    """Return a dict of plain values from SQS MessageAttributes.
+
+    Attributes that can't be decoded are logged and left out.
+    """
+    decoded = {}
+    for key, value in (message_attributes or {}).items():
+        try:
+            if value.get('DataType', '').startswith('Number'):
+                decoded[key] = _decode_number(value['StringValue'])
+            elif 'StringValue' in value:
+                decoded[key] = value['StringValue']
+            else:
+                decoded[key] = value.get('BinaryValue')
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.warning('Could not decode message attribute %s: %r',
+                           key, value)
+    return decoded
@@ -0,0 +1,121 @@
+"""Circuit breaker to stop work while handlers are failing systematically.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+    """Track the recent failure rate and trip when it gets too high.
+
+    The breaker is `closed` while things work. When at least `min_calls`
+    results in the last `window` seconds include `failure_rate` or more
+    failures it opens, and `allow` returns `False` for `reset_timeout`
+    seconds. It is then `half_open`: `allow` lets `probe_size` attempts
+    through, and `probe_size` successes in a row close it while a single
+    failure opens it again. A probe with no result after `reset_timeout`
+    seconds is given up, so another can be allowed.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window=60,
+                 reset_timeout=30, probe_size=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.probe_size = probe_size
+
+        self._state = self.CLOSED
+        self._results = deque()
+        self._opened_at = None
+        self._probe_successes = 0
+        self._probes = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Return the current state, moving from open to half-open if due.
+        """
+        with self._lock:
+            if (self._state == self.OPEN and
+                    time.time() >= self._opened_at + self.reset_timeout):
+                logger.info('Circuit %s half-open, probing', self.name)
+                self._state = self.HALF_OPEN
+                self._probe_successes = 0
+                self._probes.clear()
+            return self._state
+
+    def allow(self):
+        """Return whether work may be attempted now.
+
+        While half-open each `True` counts as a probe, until `probe_size`
+        probes are waiting for their results.
+        """
+        state = self.state
+        if state == self.OPEN:
+            return False
+        if state == self.HALF_OPEN:
+            with self._lock:
+                now = time.time()
+                while (self._probes and
+                       self._probes[0] <= now - self.reset_timeout):
+                    self._probes.popleft()
+                if len(self._probes) >= self.probe_size:
+                    return False
+                self._probes.append(now)
+        return True
+
+    def retry_in(self):
+        """Return the seconds until the open breaker will allow a probe.
+        """
+        if self.state != self.OPEN:
+            return 0
+        return max(0, self._opened_at + self.reset_timeout - time.time())
+
+    def record(self, success):
+        """Record the result of one piece of work.
+        """
+        state = self.state
+        with self._lock:
+            now = time.time()
+            if state == self.HALF_OPEN:
+                if self._probes:
+                    self._probes.popleft()
+                if not success:
+                    self._open(now)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probe_size:
+                    logger.info('Circuit %s closed', self.name)
+                    self._state = self.CLOSED
+                    self._results.clear()
+                return
+
+            self._results.append((now, success))
+            while self._results and self._results[0][0] < now - self.window:
+                self._results.popleft()
+
+            if state == self.CLOSED and len(self._results) >= self.min_calls:
+                failures = sum(1 for _, ok in self._results if not ok)
+                if failures >= self.failure_rate * len(self._results):
+                    self._open(now)
+
+    def _open(self, now):
+        """Trip the breaker. Must be called holding the lock.
+        """
+        logger.warning('Circuit %s open for %ss', self.name,
+                       self.reset_timeout)
+        self._state = self.OPEN
+        self._opened_at = now
+        self._results.clear()
@@ -1,24 +1,54 @@
 """Mock SQS to let you "interact" with SQS
 """
+import threading
+import time
+import uuid
+
+from queue_fetcher.utils.attributes import encode_attributes
 
 
 class MockMessage(object):
-    def __init__(self, body):
+    def __init__(self, body, message_attributes=None, sent_at=None):
         self.body = body
+        self.message_attributes = message_attributes
+        self.message_id = uuid.uuid4().hex
+        self.receipt_handle = uuid.uuid4().hex
+        self.attributes = {
+            'SentTimestamp': str(int((sent_at or time.time()) * 1000)),
+        }
+        self.visibility_timeout = None
 
-    def delete():
+    def delete(self):
         pass
 
+    def change_visibility(self, VisibilityTimeout):
+        self.visibility_timeout = VisibilityTimeout
+
 
 class MockQueue(object):
     def __init__(self, name):
         self.name = name
         self._inbox = []
+        self._lock = threading.Lock()
 
-    def add_message(self, msg):
-        self._inbox.append(MockMessage(msg))
+    def add_message(self, msg, attributes=None, sent_at=None):
+        if attributes:
+            attributes = encode_attributes(attributes)
+        self._inbox.append(MockMessage(msg, attributes, sent_at))
 
     def receive_messages(self, *args, **kwargs):
-        i = self._inbox
-        self._inbox = []
+        with self._lock:
+            count = kwargs.get('MaxNumberOfMessages', len(self._inbox))
+            i = self._inbox[:count]
+            self._inbox = self._inbox[count:]
         return i
+
+    def send_messages(self, Entries):
+        with self._lock:
+            for entry in Entries:
+                self._inbox.append(MockMessage(
+                    entry['MessageBody'], entry.get('MessageAttributes')))
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+    def delete_messages(self, Entries):
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
@@ -0,0 +1,31 @@
+"""Inspect the running worker process.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def get_rss():
+    """Return the resident memory of this process in bytes, or `None`.
+
+    Falls back to the peak resident memory where /proc isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as fd:
+            pages = int(fd.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    else:
+        return pages * resource.getpagesize()
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,239 @@
+"""Rate and concurrency limits for message handlers.
+
+Limits are kept in-process by default. Pass a Django cache alias to share
+them between worker processes - the cache must support atomic `incr`, such
+as memcached or redis.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import math
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """An in-process token bucket refilled at `rate` tokens per second.
+
+    A request for more than `burst` tokens is allowed once the bucket is full
+    and leaves it in debt, so large requests still average out at `rate`.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """Add the tokens earned since the last update. Hold the lock.
+        """
+        now = time.time()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Take `tokens` from the bucket, returning whether there were enough.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < min(tokens, self.burst):
+                return False
+            self._tokens -= tokens
+            return True
+
+    def refund(self, tokens=1):
+        """Give back tokens taken by `acquire` that were not used.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.burst, self._tokens + tokens)
+
+
+class CacheTokenBucket(object):
+    """Approximate a token bucket across processes with windowed counters.
+
+    Each window of `burst / rate` seconds allows `burst` tokens, so the
+    sustained rate is `rate`. A request for more than `burst` tokens needs an
+    empty window and spills the rest into the windows after it.
+    """
+
+    def __init__(self, key, rate, burst=None, cache=None):
+        self.key = key
+        self.rate = float(rate)
+        self.burst = max(1, int(burst or rate))
+        self.period = self.burst / self.rate
+        self.cache = cache
+
+    def _charges(self, tokens):
+        """Yield the key, timeout and tokens to count in each window.
+        """
+        now = time.time()
+        window = int(now / self.period)
+        while tokens > 0:
+            step = min(tokens, self.burst)
+            timeout = int(math.ceil((window + 1) * self.period - now)) + 1
+            yield '{}:{}'.format(self.key, window), timeout, step
+            tokens -= step
+            window += 1
+
+    def acquire(self, tokens=1):
+        """Count `tokens` against the current and, if needed, later windows.
+        """
+        charges = list(self._charges(tokens))
+        key, timeout, step = charges[0]
+        self.cache.add(key, 0, timeout)
+        if self.cache.incr(key, step) > self.burst:
+            self.cache.decr(key, step)
+            return False
+
+        for key, timeout, step in charges[1:]:
+            self.cache.add(key, 0, timeout)
+            self.cache.incr(key, step)
+        return True
+
+    def refund(self, tokens=1):
+        """Give back tokens taken by `acquire` that were not used.
+        """
+        for key, _, step in self._charges(tokens):
+            try:
+                self.cache.decr(key, step)
+            except ValueError:
+                # The window has already expired
+                pass
+
+
+class Semaphore(object):
+    """An in-process, non-blocking counting semaphore.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot.
+
+        :returns: A lease to pass to `release`, or `None` if none were free
+        """
+        with self._lock:
+            if self._count >= self.limit:
+                return None
+            self._count += 1
+            return True
+
+    def release(self, lease):
+        """Give a slot back.
+        """
+        with self._lock:
+            self._count -= 1
+
+
+class CacheSemaphore(object):
+    """A non-blocking counting semaphore shared through the Django cache.
+
+    Each of the `limit` slots is its own cache key, leased for `timeout`
+    seconds. A worker killed while holding a slot only keeps it until the
+    lease expires, so `timeout` should be longer than a message can take.
+    """
+
+    def __init__(self, key, limit, cache=None, timeout=3600):
+        self.key = key
+        self.limit = limit
+        self.cache = cache
+        self.timeout = timeout
+
+    def acquire(self):
+        """Lease a free slot.
+
+        :returns: A lease to pass to `release`, or `None` if none were free
+        """
+        token = uuid.uuid4().hex
+        for slot in range(self.limit):
+            key = '{}:{}'.format(self.key, slot)
+            if self.cache.add(key, token, self.timeout):
+                return key, token
+        return None
+
+    def release(self, lease):
+        """Give a slot back, unless its lease expired and was taken again.
+        """
+        key, token = lease
+        if self.cache.get(key) == token:
+            self.cache.delete(key)
+        else:
+            logger.warning('Lease on %s expired before it was released', key)
+
+
+class RateLimit(object):
+    """The combined rate and concurrency limit for one message type.
+
+    :param rate: Messages per second, or `None` for no rate limit
+    :param burst: Largest burst allowed above `rate`
+    :param concurrency: Messages handled at once, or `None` for no limit
+    :param cache: Django cache alias to share the limit between processes
+    :param lease_timeout: Seconds a worker that dies holding a shared
+        concurrency slot keeps it for
+    """
+
+    def __init__(self, key, rate=None, burst=None, concurrency=None,
+                 cache=None, lease_timeout=3600):
+        self.bucket = None
+        self.semaphore = None
+
+        if cache is not None:
+            from django.core.cache import caches
+            cache = caches[cache]
+            key = 'queue_fetcher:limit:{}'.format(key)
+
+            if rate is not None:
+                self.bucket = CacheTokenBucket(key + ':rate', rate, burst,
+                                               cache=cache)
+            if concurrency is not None:
+                self.semaphore = CacheSemaphore(key + ':concurrency',
+                                                concurrency, cache=cache,
+                                                timeout=lease_timeout)
+        else:
+            if rate is not None:
+                self.bucket = TokenBucket(rate, burst)
+            if concurrency is not None:
+                self.semaphore = Semaphore(concurrency)
+
+    def acquire(self, count=1):
+        """Reserve a slot for `count` messages of this type.
+
+        :returns: A lease to pass to `release` when done, or `None` if over
+            the limits
+        """
+        lease = True
+        if self.semaphore is not None:
+            lease = self.semaphore.acquire()
+            if lease is None:
+                return None
+
+        if self.bucket is not None and not self.bucket.acquire(count):
+            self.release(lease)
+            return None
+
+        return lease
+
+    def release(self, lease):
+        """Release the slot taken by `acquire`.
+        """
+        if self.semaphore is not None:
+            self.semaphore.release(lease)
+
+    def cancel(self, lease, count=1):
+        """Release the slot and refund the rate taken by `acquire` for
+        messages that were not processed.
+        """
+        if self.bucket is not None:
+            self.bucket.refund(count)
+        self.release(lease)
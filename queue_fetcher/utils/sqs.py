@@ -4,21 +4,30 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import json
 import logging
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
 
-import boto3
 import six
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
 
 from queue_fetcher.exceptions import (BotoInitFailedException,
                                       QueueNotFoundError,
                                       MessageSendFailed)
+from queue_fetcher.utils.attributes import encode_attributes, message_types
 from queue_fetcher.utils.mock_sqs import MockQueue
+from queue_fetcher.utils.tracing import get_tracer
 
 
 outbox = {}
 
+# Longest DelaySeconds supported by SQS
+MAX_DELAY = 900
+
 
 logger = logging.getLogger(__name__)
 
@@ -31,9 +40,57 @@ SQS_NOT_SETUP = (
 
 _MOCKS = {}
 
+# boto3 resources aren't thread-safe, so each thread keeps its own SQS
+# resources by region, and queues by URL, created on first use
+_local = threading.local()
+
+
+def _get_resource(region_name):
+    """Return this thread's SQS resource for the region.
+
+    boto3 is slow to import, so it is only imported the first time a real
+    queue is needed.
+    """
+    resources = _local.__dict__.setdefault('resources', {})
+    if region_name not in resources:
+        import boto3.session
+        resources[region_name] = boto3.session.Session().resource(
+            'sqs', region_name=region_name)
+    return resources[region_name]
+
+
+def thread_queue(queue):
+    """Return the same queue on this thread's boto3 resource.
+
+    Use this before calling a queue from threads other than the one that
+    looked it up. Mock queues are returned as they are.
+    """
+    if 'boto3' not in sys.modules:
+        return queue
+    from boto3.resources.base import ServiceResource
+    if not isinstance(queue, ServiceResource):
+        return queue
+
+    queues = _local.__dict__.setdefault('queues', {})
+    if queue.url not in queues:
+        region_name = queue.meta.client.meta.region_name
+        queues[queue.url] = _get_resource(region_name).Queue(queue.url)
+    return queues[queue.url]
+
+
+def warm_up(regions=('eu-west-1',)):
+    """Import boto3 and create the SQS resources for the regions now.
+
+    Call this before forking worker processes, such as from a gunicorn
+    `on_starting` hook, so each worker doesn't pay the cost itself. Other
+    threads still create their own resources when they first need one.
+    """
+    for region_name in regions:
+        _get_resource(region_name)
+
 
 def _get_sqs_queue(region_name, queue_name, account=None):
-    sqs = boto3.resource('sqs', region_name=region_name)
+    sqs = _get_resource(region_name)
 
     if account is not None:
         queue = sqs.get_queue_by_name(
@@ -67,22 +124,19 @@ def get_queue(name, region_name='eu-west-1', account=None,
     except AttributeError:
         raise ImproperlyConfigured(SQS_NOT_SETUP)
 
+    queue_name = name
     if _is_arn(name):
         region_name, account, queue_name = name.split(':')[3:]
 
-    if account is None:
-        queue_name = name
-
-    sqs = boto3.resource('sqs', region_name=region_name)
-
-    if sqs is None:
-        raise BotoInitFailedException('Could not initialise sqs')
-
     if test_sqs:
-        if name not in _MOCKS:
+        if queue_name not in _MOCKS:
             _MOCKS[queue_name] = MockQueue(queue_name)
         queue = _MOCKS[queue_name]
     else:
+        sqs = _get_resource(region_name)
+
+        if sqs is None:
+            raise BotoInitFailedException('Could not initialise sqs')
 
         try:
             if account is None:
@@ -104,12 +158,31 @@ def get_queue(name, region_name='eu-west-1', account=None,
     return queue
 
 
-def send_message(queue, message, raise_exception=True):
+def _delay_seconds(delay):
+    """Return the delay, a number of seconds or a timedelta, in seconds.
+    """
+    if isinstance(delay, timedelta):
+        delay = delay.total_seconds()
+    return max(0, delay)
+
+
+def send_message(queue, message, raise_exception=True, attributes=None,
+                 delay=None):
     """Send message on queue.
 
     This handles the nitty-gritty of interacting with SQS from your Django app.
     If TEST_SQS is set in settings, this will print the output to console.
     NOTE: TEST_SQS must be set to either True or False for this to work.
+
+    The message_types of a dict or list message are sent as the
+    `message_type` message attribute, comma-separated, so consumers can route
+    it without decoding the body. Pass `attributes` to send extra attributes.
+    The trace context from QUEUE_FETCHER_TRACER is sent as well.
+
+    Pass `delay`, in seconds or as a timedelta, to hide the message from
+    consumers for that long. Delays longer than SQS allows are sent with a
+    `deliver_at` attribute, and QueueFetcher puts the message back on the
+    queue until it is due.
     """
     try:
         test_sqs = settings.TEST_SQS
@@ -121,6 +194,20 @@ def send_message(queue, message, raise_exception=True):
 
     is_text = isinstance(message, six.string_types)
 
+    message_attributes = get_tracer().inject()
+    if not is_text:
+        types = message_types(message)
+        if types:
+            message_attributes['message_type'] = ','.join(types)
+    message_attributes.update(attributes or {})
+
+    delay_seconds = None
+    if delay is not None:
+        delay = _delay_seconds(delay)
+        delay_seconds = int(min(delay, MAX_DELAY))
+        if delay > MAX_DELAY:
+            message_attributes['deliver_at'] = time.time() + delay
+
     if test_sqs:
         # Test Mode: Don't even try and send it!
         if is_text:
@@ -130,12 +217,21 @@ def send_message(queue, message, raise_exception=True):
             outbox[queue.name] = []
         outbox[queue.name].append(message)
         logger.info('New message on queue %s: %s', queue.name, message)
+        if delay is not None:
+            logger.info('Message would be delayed for %ss', delay)
     else:
         if not is_text:
             message = json.dumps(message)
 
+        kwargs = {'MessageBody': message}
+        if delay_seconds:
+            kwargs['DelaySeconds'] = delay_seconds
+        if message_attributes:
+            kwargs['MessageAttributes'] = encode_attributes(
+                message_attributes)
+
         try:
-            queue.send_message(MessageBody=message)
+            queue.send_message(**kwargs)
         except Exception as exc:
             if raise_exception:
                 raise MessageSendFailed(
@@ -146,11 +242,19 @@ def send_message(queue, message, raise_exception=True):
                            six.text_type(exc))
 
 
-def queue_send(queue, message, raise_exception=True):
+def send_at(queue, message, when, raise_exception=True, attributes=None):
+    """Send message on queue, to be delivered at the datetime `when`.
+    """
+    now = timezone.now() if timezone.is_aware(when) else datetime.now()
+    send_message(queue, message, raise_exception=raise_exception,
+                 attributes=attributes, delay=when - now)
+
+
+def queue_send(queue, message, raise_exception=True, delay=None):
     """Combined queue retrieval and send
     """
     queue = get_queue(settings.QUEUES[queue], raise_exception=raise_exception)
-    send_message(queue, message, raise_exception=raise_exception)
+    send_message(queue, message, raise_exception=raise_exception, delay=delay)
 
 
 def requeue(queue, message, raise_exception=True):
@@ -165,3 +269,9 @@ def clear_outbox():
     keys = [k for k in outbox]
     for key in keys:
         del outbox[key]
+
+
+def clear_queues():
+    """Empty and forget the test mock queues.
+    """
+    _MOCKS.clear()
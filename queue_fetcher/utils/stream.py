@@ -0,0 +1,62 @@
+"""Incrementally decode large JSON list messages.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import re
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def _skip(text, idx):
+    """Return the index of the next non-whitespace character.
+    """
+    return _WHITESPACE.match(text, idx).end()
+
+
+def iter_json_array(text):
+    """Yield each item of a top-level JSON array as it is decoded.
+
+    Only one item is held in memory at a time. Anything other than an array
+    is decoded in full and yielded as a single item.
+    """
+    idx = _skip(text, 0)
+    if text[idx:idx + 1] != '[':
+        yield json.loads(text)
+        return
+
+    idx = _skip(text, idx + 1)
+    if text[idx:idx + 1] == ']':
+        idx += 1
+    else:
+        while True:
+            item, idx = _DECODER.raw_decode(text, idx)
+            yield item
+
+            idx = _skip(text, idx)
+            char = text[idx:idx + 1]
+            if char == ']':
+                idx += 1
+                break
+            if char != ',':
+                raise ValueError(
+                    'Expecting , delimiter: char {}'.format(idx))
+            idx = _skip(text, idx + 1)
+
+    if _skip(text, idx) != len(text):
+        raise ValueError('Extra data: char {}'.format(idx))
+
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items from `iterable`.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,267 @@
+"""Trace messages from send_message through to their handlers.
+
+Set QUEUE_FETCHER_TRACER in your settings to the dotted path of a `Tracer`
+subclass to record spans. The default `Tracer` records nothing.
+`JSONFileTracer` appends each finished span to QUEUE_FETCHER_TRACE_FILE as a
+line of JSON.
+
+Messages sent inside an open span carry its trace and span ids, so the
+consumer's spans become its children. Messages sent outside any span start a
+new trace.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import atexit
+import io
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import six
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+_tracer = None
+
+
+def _new_id():
+    """Return a random 64-bit hex id.
+    """
+    return uuid.uuid4().hex[:16]
+
+
+def current_span():
+    """Return the innermost span open in this thread, or `None`.
+    """
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+class Span(object):
+    """A timed operation within a trace.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        """Return the span duration in seconds.
+        """
+        return (self.end or time.time()) - self.start
+
+    def set_attribute(self, key, value):
+        """Record a value against this span.
+        """
+        self.attributes[key] = value
+
+    def as_dict(self):
+        """Return the span as a JSON-serialisable dict.
+        """
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'attributes': self.attributes,
+        }
+
+
+class _NullSpan(object):
+    """A span that records nothing.
+    """
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """The default tracer, which records nothing.
+    """
+
+    def inject(self):
+        """Return the trace attributes to send with a new message.
+        """
+        return {}
+
+    @contextmanager
+    def span(self, name, parent=None, attributes=None):
+        """Time the body of the `with` block as a child of `parent`.
+
+        :param parent: Message attributes holding the `trace_id` and
+            `span_id` of the sender, or `None` to use the current span
+        """
+        yield _NULL_SPAN
+
+
+class RecordingTracer(Tracer):
+    """Base class for tracers that export finished spans.
+    """
+
+    def inject(self):
+        """Return the current trace context and the time it was sent.
+
+        Outside a span only a new trace id is sent, so the consumer's span
+        has no parent.
+        """
+        span = current_span()
+        if span is None:
+            return {'trace_id': _new_id(), 'enqueued_at': time.time()}
+
+        return {
+            'trace_id': span.trace_id,
+            'span_id': span.span_id,
+            'enqueued_at': time.time(),
+        }
+
+    @contextmanager
+    def span(self, name, parent=None, attributes=None):
+        """Time the body of the `with` block, then export the span.
+        """
+        if parent and 'trace_id' in parent:
+            trace_id = parent['trace_id']
+            parent_id = parent.get('span_id')
+        else:
+            current = current_span()
+            trace_id = current.trace_id if current else _new_id()
+            parent_id = current.span_id if current else None
+
+        span = Span(name, trace_id, parent_id, attributes)
+        if parent and 'enqueued_at' in parent:
+            span.set_attribute('queue_wait',
+                               span.start - parent['enqueued_at'])
+
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        _local.stack.append(span)
+        try:
+            yield span
+        except Exception as ex:
+            span.set_attribute('error', six.text_type(ex))
+            raise
+        finally:
+            _local.stack.pop()
+            span.end = time.time()
+            self.export(span)
+
+    def export(self, span):
+        """Send a finished span to its destination.
+        """
+        raise NotImplementedError('RecordingTracer.export')
+
+
+class JSONFileTracer(RecordingTracer):
+    """Append each finished span to a file as a line of JSON.
+
+    The file is kept open and written through a buffer. It is flushed when
+    a span is written `flush_interval` seconds after the last flush, and
+    when the process exits.
+    """
+
+    def __init__(self, path=None, flush_interval=1.0):
+        self.path = path or settings.QUEUE_FETCHER_TRACE_FILE
+        self.flush_interval = flush_interval
+        self._fd = None
+        self._flushed = time.time()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def export(self, span):
+        """Write the span to the trace file.
+        """
+        line = six.text_type(json.dumps(span.as_dict(),
+                                        default=six.text_type))
+        try:
+            with self._lock:
+                if self._fd is None:
+                    self._fd = io.open(self.path, 'a', encoding='utf-8')
+                self._fd.write(line + '\n')
+                if time.time() - self._flushed >= self.flush_interval:
+                    self._flush()
+        except (IOError, OSError) as ex:
+            logger.warning('Could not write span to %s - %s', self.path, ex)
+
+    def _flush(self):
+        """Flush the buffered spans. Hold the lock.
+        """
+        if self._fd is not None:
+            self._fd.flush()
+        self._flushed = time.time()
+
+    def flush(self):
+        """Write any buffered spans to the trace file.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Flush and close the trace file.
+        """
+        with self._lock:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+
+class StatsTracer(RecordingTracer):
+    """Keep the count, errors and total duration of spans by name.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        """Add the span to the totals for its name.
+        """
+        with self._lock:
+            count, errors, total = self.stats.get(span.name, (0, 0, 0.0))
+            self.stats[span.name] = (
+                count + 1,
+                errors + (1 if 'error' in span.attributes else 0),
+                total + span.duration)
+
+
+def get_tracer():
+    """Return the tracer set by QUEUE_FETCHER_TRACER.
+    """
+    global _tracer
+
+    if _tracer is None:
+        path = getattr(settings, 'QUEUE_FETCHER_TRACER', None)
+        _tracer = import_string(path)() if path else Tracer()
+    return _tracer
+
+
+@receiver(setting_changed)
+def _reset_tracer(setting, **kwargs):
+    """Rebuild the tracer when its settings are overridden.
+    """
+    global _tracer
+
+    if setting in ('QUEUE_FETCHER_TRACER', 'QUEUE_FETCHER_TRACE_FILE'):
+        if hasattr(_tracer, 'close'):
+            _tracer.close()
+        _tracer = None
@@ -0,0 +1,329 @@
+"""Move messages in bulk between queues and JSON lines files.
+
+Records are written one per line as JSON with the message `body` and its
+`message_attributes` in SQS format, with binary values base64-encoded. Files
+ending `.gz` are gzipped.
+
+boto3 queues aren't thread-safe, so each worker thread calls SQS through
+its own copy from `sqs.thread_queue`.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import base64
+import copy
+import gzip
+import io
+import json
+import logging
+import threading
+import time
+
+import six
+
+from django.conf import settings
+
+from queue_fetcher.exceptions import MessageSendFailed
+from queue_fetcher.utils import sqs
+from queue_fetcher.utils.ratelimit import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+# Most messages SQS will send, receive or delete in one request
+BATCH_SIZE = 10
+# Most bytes of bodies and attributes SQS will send in one request
+MAX_BATCH_BYTES = 262144
+
+
+def resolve_queue(name):
+    """Return the queue for an internal name in QUEUES, a queue name or ARN.
+    """
+    return sqs.get_queue(getattr(settings, 'QUEUES', {}).get(name, name))
+
+
+def open_jsonl(path, mode='r'):
+    """Open a JSON lines file for text, gunzipping files ending `.gz`.
+    """
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, mode + 'b'), encoding='utf-8')
+    return io.open(path, mode, encoding='utf-8')
+
+
+def _binary_values(record):
+    """Yield each binary message attribute value in a record.
+    """
+    for value in (record.get('message_attributes') or {}).values():
+        if 'BinaryValue' in value:
+            yield value
+
+
+def dump_record(record):
+    """Return a record as a line of JSON text.
+    """
+    record = copy.deepcopy(record)
+    for value in _binary_values(record):
+        value['BinaryValue'] = base64.b64encode(
+            value['BinaryValue']).decode('ascii')
+    return six.text_type(json.dumps(record)) + '\n'
+
+
+def load_record(line):
+    """Return the record from a line written by `dump_record`.
+    """
+    record = json.loads(line)
+    for value in _binary_values(record):
+        value['BinaryValue'] = base64.b64decode(value['BinaryValue'])
+    return record
+
+
+def read_records(path, skip=0):
+    """Yield each record in a JSON lines file, after the first `skip`.
+    """
+    with open_jsonl(path) as fd:
+        for index, line in enumerate(fd):
+            if index < skip or not line.strip():
+                continue
+            yield load_record(line)
+
+
+def to_record(message):
+    """Return the JSON lines record for a received message.
+    """
+    record = {'body': message.body}
+    if getattr(message, 'message_attributes', None):
+        record['message_attributes'] = message.message_attributes
+    return record
+
+
+def batched(iterable, size=BATCH_SIZE):
+    """Yield lists of up to `size` items.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Throttle(object):
+    """Block until a TokenBucket allows the next batch through.
+    """
+
+    def __init__(self, rate=None):
+        self.bucket = None
+        if rate:
+            self.bucket = TokenBucket(rate, max(rate, BATCH_SIZE))
+
+    def wait(self, count=1):
+        """Wait for `count` tokens.
+        """
+        if self.bucket is None:
+            return
+        while not self.bucket.acquire(count):
+            time.sleep(count / self.bucket.rate / 10.0)
+
+
+def _entry_size(entry):
+    """Return the bytes SQS counts for a send entry's body and attributes.
+    """
+    size = len(entry['MessageBody'].encode('utf-8'))
+    for name, value in (entry.get('MessageAttributes') or {}).items():
+        data = value.get('StringValue', value.get('BinaryValue', ''))
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        size += len(name.encode('utf-8')) + len(value['DataType']) + len(data)
+    return size
+
+
+def _send_entries(queue, entries):
+    """Send the entries in one request, raising if any failed.
+    """
+    response = queue.send_messages(Entries=entries)
+    failed = response.get('Failed') or []
+    if failed:
+        raise MessageSendFailed('Could not send {} of {} messages: {}'.format(
+            len(failed), len(entries), failed[0].get('Message')))
+
+
+def send_batch(queue, records):
+    """Send up to 10 records to the queue, splitting them into as few
+    requests as fit in MAX_BATCH_BYTES.
+    """
+    request = []
+    size = 0
+    for index, record in enumerate(records):
+        entry = {'Id': six.text_type(index), 'MessageBody': record['body']}
+        if record.get('message_attributes'):
+            entry['MessageAttributes'] = record['message_attributes']
+
+        entry_size = _entry_size(entry)
+        if request and size + entry_size > MAX_BATCH_BYTES:
+            _send_entries(queue, request)
+            request = []
+            size = 0
+        request.append(entry)
+        size += entry_size
+
+    if request:
+        _send_entries(queue, request)
+
+
+def delete_batch(queue, messages):
+    """Delete up to 10 received messages from the queue in one request.
+    """
+    response = queue.delete_messages(Entries=[
+        {'Id': six.text_type(index), 'ReceiptHandle': message.receipt_handle}
+        for index, message in enumerate(messages)])
+
+    failed = response.get('Failed') or []
+    if failed:
+        logger.warning('Could not delete %d messages: %s',
+                       len(failed), failed[0].get('Message'))
+
+
+def run_threads(workers, target):
+    """Run `target` in `workers` threads, re-raising the first error.
+    """
+    errors = []
+
+    def run():
+        try:
+            target()
+        except Exception as ex:  # pylint: disable=W0703
+            logger.exception('Transfer worker failed')
+            errors.append(ex)
+
+    threads = [threading.Thread(target=run) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+class Receiver(object):
+    """Drain a queue with parallel receivers, passing on each batch.
+
+    `handle_batch` is called from the worker threads.
+
+    Each worker stops once it gets `empty_receives` empty responses in a row,
+    or when `limit` messages have been received between them.
+
+    Set `unique` when messages are not deleted as they are handled. Messages
+    that come back once their visibility timeout is up are then recognised by
+    their MessageId and not passed on again, and a response with no new
+    messages counts as empty.
+    """
+
+    def __init__(self, queue, handle_batch, workers=4, limit=None, rate=None,
+                 visibility_timeout=300, wait_time=1, empty_receives=2,
+                 unique=False):
+        self.queue = queue
+        self.handle_batch = handle_batch
+        self.workers = workers
+        self.limit = limit
+        self.throttle = Throttle(rate)
+        self.visibility_timeout = visibility_timeout
+        self.wait_time = wait_time
+        self.empty_receives = empty_receives
+        self.unique = unique
+
+        self.count = 0
+        self.repeats = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Return how many messages this worker may receive next.
+        """
+        with self._lock:
+            if self.limit is None:
+                return BATCH_SIZE
+            return max(0, min(BATCH_SIZE, self.limit - self.count))
+
+    def _work(self):
+        """Receive batches until the queue is empty or the limit is reached.
+        """
+        queue = sqs.thread_queue(self.queue)
+        empty = 0
+        while empty < self.empty_receives:
+            size = self._reserve()
+            if not size:
+                return
+
+            messages = queue.receive_messages(
+                MaxNumberOfMessages=size,
+                WaitTimeSeconds=self.wait_time,
+                VisibilityTimeout=self.visibility_timeout,
+                MessageAttributeNames=['All'])
+
+            with self._lock:
+                if self.unique:
+                    received = len(messages)
+                    messages = [message for message in messages
+                                if message.message_id not in self._seen]
+                    self.repeats += received - len(messages)
+                if self.limit is not None:
+                    messages = messages[:self.limit - self.count]
+                if self.unique:
+                    self._seen.update(message.message_id
+                                      for message in messages)
+                self.count += len(messages)
+
+            if not messages:
+                empty += 1
+                continue
+            empty = 0
+
+            self.throttle.wait(len(messages))
+            self.handle_batch(messages)
+
+    def run(self):
+        """Receive from the queue until it is drained.
+
+        :returns: The number of messages received
+        """
+        run_threads(self.workers, self._work)
+        if self.repeats:
+            logger.warning('%d messages were received again after their '
+                           'visibility timeout and skipped', self.repeats)
+        return self.count
+
+
+class Progress(object):
+    """Remember how many records have been sent, so a run can be resumed.
+
+    Batches can finish out of order, so only the number of records before
+    the first unfinished batch is saved.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.done = 0
+        self._finished = {}
+        self._lock = threading.Lock()
+
+        if path is not None:
+            try:
+                with io.open(path) as fd:
+                    self.done = int(fd.read().strip() or 0)
+            except (IOError, OSError):
+                pass
+
+    def finish(self, start, count):
+        """Mark the `count` records from index `start` as sent.
+        """
+        with self._lock:
+            self._finished[start] = count
+            while self.done in self._finished:
+                self.done += self._finished.pop(self.done)
+
+            if self.path is not None:
+                with io.open(self.path, 'w') as fd:
+                    fd.write(six.text_type(self.done))
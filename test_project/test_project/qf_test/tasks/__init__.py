@@ -1 +1 @@
-from test_project.qf_test.tasks.queues import SampleQueueTask
+from test_project.qf_test.tasks.queues import SampleQueueTask, UserTask
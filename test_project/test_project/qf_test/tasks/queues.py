@@ -1,4 +1,9 @@
-from queue_fetcher.tasks import QueueFetcher
+import time
+
+from django.contrib.auth.models import User
+
+from queue_fetcher.exceptions import MessageProcessingError
+from queue_fetcher.tasks import MultiQueueFetcher, QueueFetcher
 
 
 class SampleCalledException(Exception):
@@ -31,3 +36,209 @@ class VisibilityTask(QueueFetcher):
         """Process a sample message.
         """
         return True
+
+
+class MultiTask(MultiQueueFetcher):
+    """Poll two queues, favouring the test queue.
+    """
+
+    queues = {
+        'test': 2,
+        'other': 1,
+    }
+
+    def __init__(self):
+        super(MultiTask, self).__init__()
+        self.seen = []
+
+    def process_sample(self, msg):
+        """Record the sample message.
+        """
+        self.seen.append(msg['test'])
+
+
+class LimitedTask(QueueFetcher):
+    """Limit how quickly sample messages are handled.
+    """
+
+    queue = 'test'
+    rate_limits = {
+        'sample': {'rate': 2},
+        'slow': {'concurrency': 1},
+    }
+
+    def process_sample(self, msg):
+        """Process a sample message.
+        """
+        return True
+
+    def process_slow(self, msg):
+        """Process a slow message.
+        """
+        return True
+
+
+class RoutingTask(QueueFetcher):
+    """Leave unknown messages for another consumer.
+    """
+
+    queue = 'test'
+    unhandled_action = 'defer'
+
+    def process_sample(self, msg):
+        """Process a sample message.
+        """
+        return True
+
+
+class StreamingTask(QueueFetcher):
+    """Decode list messages a few events at a time.
+    """
+
+    queue = 'test'
+    stream_decode = True
+    stream_chunk_size = 2
+
+    def __init__(self):
+        super(StreamingTask, self).__init__()
+        self.chunks = []
+
+    def process(self, msg):
+        """Record the size of each chunk processed.
+        """
+        if isinstance(msg, list):
+            self.chunks.append(len(msg))
+        return super(StreamingTask, self).process(msg)
+
+    def process_sample(self, msg):
+        """Process a sample message.
+        """
+        if msg['test'] == 'fail':
+            raise MessageProcessingError('Sample failed')
+
+
+class DeadlineTask(QueueFetcher):
+    """Time out slow messages.
+    """
+
+    queue = 'test'
+    default_deadline = 0.05
+    deadlines = {
+        'unlimited': None,
+    }
+
+    def process_slow(self, msg):
+        """Take longer than the deadline.
+        """
+        time.sleep(msg.get('sleep', 1))
+
+    def process_unlimited(self, msg):
+        """Run without a deadline.
+        """
+        time.sleep(0.1)
+
+    def process_cooperative(self, msg):
+        """Check the deadline while working.
+        """
+        while True:
+            time.sleep(0.01)
+            self.check_deadline()
+
+
+class BreakerTask(QueueFetcher):
+    """Stop receiving when samples keep failing.
+    """
+
+    queue = 'test'
+    circuit_breaker = {
+        'min_calls': 2,
+        'failure_rate': 0.5,
+        'reset_timeout': 10,
+        'probe_size': 1,
+    }
+
+    def process_sample(self, msg):
+        """Fail on request.
+        """
+        if msg.get('fail'):
+            raise MessageProcessingError('Sample failed')
+
+    def process_other(self, msg):
+        """Process another message type.
+        """
+        return True
+
+
+class StaleTask(QueueFetcher):
+    """Shed old messages.
+    """
+
+    queue = 'test'
+    park_queue = 'park'
+    stale_policies = {
+        'sample': {'max_age': 60, 'action': 'drop'},
+        'audit': {'max_age': 60, 'action': 'park'},
+        'report': {'max_age': 60, 'action': 'stale'},
+    }
+
+    def __init__(self):
+        super(StaleTask, self).__init__()
+        self.seen = []
+
+    def process_sample(self, msg):
+        """Record the sample message.
+        """
+        self.seen.append('sample')
+
+    def process_audit(self, msg):
+        """Record the audit message.
+        """
+        self.seen.append('audit')
+
+    def process_report(self, msg):
+        """Record the report message.
+        """
+        self.seen.append('report')
+
+    def process_stale_report(self, msg):
+        """Record the stale report message.
+        """
+        self.seen.append('stale_report')
+
+
+class UserTask(QueueFetcher):
+    """Create users.
+    """
+
+    queue = 'test'
+
+    def process_user(self, msg):
+        """Create a user.
+        """
+        User.objects.create(username=msg['name'])
+
+
+class PrefetchTask(QueueFetcher):
+    """Look up every user in a message at once.
+    """
+
+    queue = 'test'
+
+    def __init__(self):
+        super(PrefetchTask, self).__init__()
+        self.prefetched = []
+        self.greeted = []
+
+    def prefetch(self, events):
+        """Load the users for all the events.
+        """
+        self.prefetched.append(len(events))
+        names = [event['name'] for event in events]
+        self.batch_cache['users'] = {
+            user.username: user
+            for user in User.objects.filter(username__in=names)}
+
+    def process_greet(self, msg):
+        """Greet a prefetched user.
+        """
+        self.greeted.append(self.batch_cache['users'][msg['name']].username)
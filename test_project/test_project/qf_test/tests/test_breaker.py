@@ -0,0 +1,169 @@
+"""Test the circuit breaker.
+"""
+from mock import MagicMock, patch
+
+from django.test import TestCase
+
+from test_project.qf_test.tasks.queues import BreakerTask
+from queue_fetcher.utils.breaker import CircuitBreaker
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test the circuit breaker states.
+    """
+
+    def setUp(self):
+        patcher = patch('queue_fetcher.utils.breaker.time.time',
+                        return_value=100)
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=4,
+                                      reset_timeout=10, probe_size=2)
+
+    def trip(self):
+        for success in (True, False, True, False):
+            self.breaker.record(success)
+
+    def test_trips(self):
+        """The breaker opens at the failure rate.
+        """
+        self.breaker.record(False)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record(True)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_in(), 10)
+
+    def test_window(self):
+        """Old results are forgotten.
+        """
+        self.breaker.record(False)
+        self.breaker.record(False)
+        self.time.return_value = 200
+        self.breaker.record(False)
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_recovers(self):
+        """Successful probes close the breaker.
+        """
+        self.trip()
+        self.time.return_value = 110
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_probe_limit(self):
+        """Half-open breakers only allow probe_size probes at once.
+        """
+        self.trip()
+        self.time.return_value = 110
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record(True)
+        self.assertTrue(self.breaker.allow())
+
+    def test_probe_expires(self):
+        """Probes that never report back are given up.
+        """
+        self.trip()
+        self.time.return_value = 110
+        self.breaker.allow()
+        self.breaker.allow()
+        self.assertFalse(self.breaker.allow())
+
+        self.time.return_value = 120
+        self.assertTrue(self.breaker.allow())
+
+    def test_probe_fails(self):
+        """A failed probe opens the breaker again.
+        """
+        self.trip()
+        self.time.return_value = 110
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.retry_in(), 10)
+
+
+class BreakerTaskTestCase(TestCase):
+    """Test QueueFetcher uses its circuit breakers.
+    """
+
+    def get_message(self, msg):
+        message = MagicMock()
+        message.message_attributes = None
+        message.body = msg
+        return message
+
+    def test_stops_receiving(self):
+        """Receiving pauses while the breaker is open.
+        """
+        queue = MagicMock()
+        queue.receive_messages.return_value = [
+            self.get_message({'message_type': 'sample', 'fail': True}),
+            self.get_message({'message_type': 'sample', 'fail': True}),
+        ]
+
+        task = BreakerTask()
+        task._queue = queue
+        task._run()
+
+        with patch('queue_fetcher.tasks.base.time.sleep') as _sleep:
+            task._run()
+
+        self.assertEqual(queue.receive_messages.call_count, 1)
+        self.assertTrue(_sleep.called)
+
+    def test_probe_batch(self):
+        """Half-open breakers receive a single message.
+        """
+        queue = MagicMock()
+        queue.receive_messages.return_value = []
+
+        task = BreakerTask()
+        breaker = task._get_breaker(queue)
+        breaker._state = CircuitBreaker.HALF_OPEN
+        task._receive(queue, 20)
+
+        _args, kwargs = queue.receive_messages.call_args
+        self.assertEqual(kwargs['MaxNumberOfMessages'], 1)
+
+    def test_per_type(self):
+        """Messages of a broken type are deferred, others still run.
+        """
+        task = BreakerTask()
+        task.circuit_breaker_per_type = True
+
+        for _ in range(2):
+            task.read({'message_type': 'sample', 'fail': True})
+
+        message = self.get_message({'message_type': 'sample'})
+        self.assertEqual(task._handle_message(message), 'deferred')
+        message.change_visibility.assert_called_with(VisibilityTimeout=10)
+
+        message = self.get_message({'message_type': 'other'})
+        self.assertEqual(task._handle_message(message), 'processed')
+
+    def test_per_type_per_message(self):
+        """Each message counts once, however many events it has.
+        """
+        task = BreakerTask()
+        task.circuit_breaker_per_type = True
+
+        self.assertTrue(task.read([{'message_type': 'sample'}] * 10))
+        self.assertFalse(task.read([{'message_type': 'sample'}] * 5 +
+                                   [{'message_type': 'sample', 'fail': True}]))
+
+        self.assertEqual(task._get_type_breaker('sample').state,
+                         CircuitBreaker.OPEN)
+        self.assertEqual(task._get_type_breaker('other').state,
+                         CircuitBreaker.CLOSED)
@@ -0,0 +1,80 @@
+"""Test handler deadlines.
+"""
+import signal
+import threading
+import time
+
+from mock import MagicMock, patch
+
+from django.test import TransactionTestCase
+
+from test_project.qf_test.tasks.queues import DeadlineTask
+
+
+class DeadlineTestCase(TransactionTestCase):
+    """Test handlers are stopped at their deadline.
+    """
+
+    def read_in_thread(self, task, msg):
+        """Read the message outside the main thread.
+        """
+        result = []
+        thread = threading.Thread(target=lambda: result.append(task.read(msg)))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_interrupted(self):
+        """Hung handlers are interrupted and the message released.
+        """
+        task = DeadlineTask()
+        message = MagicMock()
+        message.message_attributes = None
+        message.body = [{'message_type': 'slow'}]
+
+        start = time.time()
+        task._handle_message(message)
+
+        self.assertLess(time.time() - start, 0.5)
+        message.change_visibility.assert_called_with(VisibilityTimeout=0)
+        self.assertFalse(message.delete.called)
+        self.assertEqual(task.timeouts['slow'], 1)
+
+    def test_timer_stopped(self):
+        """The alarm is stopped as soon as the handler returns.
+        """
+        task = DeadlineTask()
+        timers = []
+        check = task.check_deadline
+
+        def check_deadline():
+            timers.append(signal.getitimer(signal.ITIMER_REAL))
+            check()
+
+        with patch.object(task, 'check_deadline', check_deadline):
+            self.assertTrue(task.read({'message_type': 'slow', 'sleep': 0}))
+
+        self.assertEqual(timers, [(0.0, 0.0)])
+        self.assertEqual(task.timeouts['slow'], 0)
+
+    def test_no_deadline(self):
+        """Message types can opt out of the default deadline.
+        """
+        task = DeadlineTask()
+        self.assertTrue(task.read({'message_type': 'unlimited'}))
+
+    def test_cooperative(self):
+        """Outside the main thread, handlers can check their deadline.
+        """
+        task = DeadlineTask()
+        self.assertFalse(
+            self.read_in_thread(task, {'message_type': 'cooperative'}))
+        self.assertEqual(task.timeouts['cooperative'], 1)
+
+    def test_checked_after(self):
+        """Outside the main thread, late handlers fail when they return.
+        """
+        task = DeadlineTask()
+        self.assertFalse(self.read_in_thread(
+            task, {'message_type': 'slow', 'sleep': 0.1}))
+        self.assertEqual(task.timeouts['slow'], 1)
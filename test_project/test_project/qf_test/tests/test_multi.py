@@ -0,0 +1,107 @@
+"""Test polling several queues from one task.
+"""
+from mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+from test_project.qf_test.tasks.queues import MultiTask
+from queue_fetcher.tasks import MultiQueueFetcher
+from queue_fetcher.utils import sqs
+
+
+class MultiQueueTestCase(TestCase):
+    """Test the MultiQueueFetcher scheduling.
+    """
+
+    def setUp(self):
+        """Start with empty queues.
+        """
+        for name in ('test', 'other'):
+            sqs.get_queue(name).receive_messages()
+
+    def test_both_queues_processed(self):
+        """Messages on every queue reach the shared handlers.
+        """
+        sqs.get_queue('test').add_message(
+            {'message_type': 'sample', 'test': 'from test'})
+        sqs.get_queue('other').add_message(
+            {'message_type': 'sample', 'test': 'from other'})
+
+        task = MultiTask()
+        task._prerun()
+        task._run()
+        task._run()
+
+        self.assertEqual(sorted(task.seen), ['from other', 'from test'])
+
+    def test_weighted_order(self):
+        """Busy queues are polled in proportion to their weight.
+        """
+        task = MultiTask()
+        task._prerun()
+
+        picks = [task._next_state(0).key for _ in range(6)]
+
+        self.assertEqual(picks.count('test'), 4)
+        self.assertEqual(picks.count('other'), 2)
+        # Smooth round-robin interleaves rather than bursting
+        self.assertNotEqual(picks[:2], ['test', 'test'])
+
+    def test_idle_backoff(self):
+        """Idle queues are backed off and skipped until due.
+        """
+        task = MultiTask()
+        task._prerun()
+
+        with patch('queue_fetcher.tasks.multi.time.time', return_value=100):
+            task._run()
+            task._run()
+
+        test_state, other_state = sorted(task._states,
+                                         key=lambda state: state.key != 'test')
+        self.assertEqual(test_state.backoff, 1)
+        self.assertEqual(other_state.backoff, 1)
+        self.assertIsNone(task._next_state(100))
+        self.assertIsNotNone(task._next_state(101))
+
+        with patch('queue_fetcher.tasks.multi.time.time', return_value=101):
+            task._run()
+        self.assertEqual(test_state.backoff, 2)
+
+    def test_sleep_when_all_idle(self):
+        """The worker sleeps until the next queue is due.
+        """
+        task = MultiTask()
+        task._prerun()
+        for state in task._states:
+            state.next_poll = 105
+
+        with patch('queue_fetcher.tasks.multi.time') as _time:
+            _time.time.return_value = 100
+            task._run()
+
+        _time.sleep.assert_called_with(5)
+
+    def test_activity_resets_backoff(self):
+        """A queue yielding messages is polled again straight away.
+        """
+        task = MultiTask()
+        task._prerun()
+        for state in task._states:
+            state.backoff = 8
+
+        sqs.get_queue('test').add_message(
+            {'message_type': 'sample', 'test': 'hi'})
+        sqs.get_queue('other').add_message(
+            {'message_type': 'sample', 'test': 'hi'})
+        task._run()
+        task._run()
+
+        self.assertEqual([state.backoff for state in task._states], [0, 0])
+
+    def test_no_queues(self):
+        """The queues must be configured.
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            MultiQueueFetcher().run_once()
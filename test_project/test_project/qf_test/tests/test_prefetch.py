@@ -0,0 +1,55 @@
+"""Test the prefetch hook and batch cache.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from test_project.qf_test.tasks.queues import PrefetchTask
+
+
+class PrefetchTestCase(TestCase):
+    """Test handlers can share data loaded once per message.
+    """
+
+    def setUp(self):
+        for name in ('alice', 'bob', 'carol'):
+            User.objects.create(username=name)
+        self.message = [{'message_type': 'greet', 'name': name}
+                        for name in ('alice', 'bob', 'carol')]
+
+    def test_prefetch(self):
+        """Related rows are loaded in a single query.
+        """
+        task = PrefetchTask()
+        # One SELECT, inside the savepoint read() opens
+        with self.assertNumQueries(3):
+            self.assertTrue(task.read(self.message))
+
+        self.assertEqual(task.prefetched, [3])
+        self.assertEqual(task.greeted, ['alice', 'bob', 'carol'])
+
+    def test_cache_cleared(self):
+        """The cache is emptied after each message.
+        """
+        task = PrefetchTask()
+        task.read(self.message)
+        self.assertEqual(task.batch_cache, {})
+
+    def test_single_event(self):
+        """Single events are passed to prefetch as a list.
+        """
+        task = PrefetchTask()
+        task.read(self.message[0])
+        self.assertEqual(task.prefetched, [1])
+
+    def test_stream_chunks(self):
+        """Streamed messages are prefetched a chunk at a time.
+        """
+        task = PrefetchTask()
+        task.stream_decode = True
+        task.stream_chunk_size = 2
+        task.read(json.dumps(self.message))
+
+        self.assertEqual(task.prefetched, [2, 1])
+        self.assertEqual(task.greeted, ['alice', 'bob', 'carol'])
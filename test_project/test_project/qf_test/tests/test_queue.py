@@ -1,12 +1,13 @@
 """Test queue integrations.
 """
 import json
+import time
 from mock import MagicMock, patch
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from test_project.qf_test.tasks.queues import (
-    SampleQueueTask, VisibilityTask, SampleCalledException)
+    RoutingTask, SampleQueueTask, VisibilityTask, SampleCalledException)
 from queue_fetcher.utils import sqs
 from queue_fetcher.exceptions import MessageProcessingError
 
@@ -125,3 +126,179 @@ class SampleTestQueueTestCase(TestCase):
         call_args = mock_queue.receive_messages.call_args[1]
 
         self.assertEqual(call_args['VisibilityTimeout'], 30)
+
+
+class RoutingTestCase(TestCase):
+    """Test routing messages on their attributes.
+    """
+
+    def setUp(self):
+        self.queue = sqs.get_queue('test')
+        self.queue.receive_messages()
+
+    def test_defer_unhandled(self):
+        """Unhandled messages are released without being read.
+        """
+        self.queue.add_message('not json', {'message_type': 'other,unknown'})
+        message = self.queue._inbox[0]
+
+        task = RoutingTask()
+        with patch.object(task, '_read') as _read:
+            task.run_once()
+
+        self.assertFalse(_read.called)
+        self.assertEqual(message.visibility_timeout, 30)
+
+    def test_process_mixed(self):
+        """Messages with some handled types are read, not passed on.
+        """
+        self.queue.add_message([{'message_type': 'sample'},
+                                {'message_type': 'other'}],
+                               {'message_type': 'sample,other'})
+
+        task = RoutingTask()
+        with patch.object(task, '_read') as _read:
+            task.run_once()
+
+        self.assertTrue(_read.called)
+
+    def test_process_handled(self):
+        """Handled messages are read as usual.
+        """
+        self.queue.add_message({'message_type': 'sample'},
+                               {'message_type': 'sample'})
+
+        task = RoutingTask()
+        with patch.object(task, '_read') as _read:
+            task.run_once()
+
+        self.assertTrue(_read.called)
+
+    def test_skip(self):
+        """Skipped messages are deleted.
+        """
+        message = MagicMock()
+        message.message_attributes = {
+            'message_type': {'DataType': 'String', 'StringValue': 'other'}}
+
+        task = RoutingTask()
+        task.unhandled_action = 'skip'
+        task._handle_message(message)
+
+        self.assertTrue(message.delete.called)
+
+    def test_bad_attribute(self):
+        """Messages with attributes that can't be decoded are still read.
+        """
+        self.queue.add_message({'message_type': 'sample'})
+        self.queue._inbox[0].message_attributes = {
+            'weight': {'DataType': 'Number', 'StringValue': 'heavy'}}
+
+        task = RoutingTask()
+        with patch.object(task, '_read') as _read:
+            task.run_once()
+
+        self.assertTrue(_read.called)
+
+    def test_no_attributes(self):
+        """Messages without attributes are always read.
+        """
+        task = RoutingTask()
+        self.assertIsNone(task.route({}))
+
+
+class RecycleTestCase(TestCase):
+    """Test the worker stops when it reaches its limits.
+    """
+
+    def setUp(self):
+        self.queue = sqs.get_queue('test')
+        self.queue.receive_messages()
+
+    def test_max_messages(self):
+        """The worker stops after max_messages.
+        """
+        task = VisibilityTask()
+        task.max_messages = 2
+
+        for _ in range(2):
+            self.queue.add_message({'message_type': 'sample'})
+        task.run()
+
+        self.assertEqual(task._message_count, 2)
+
+    @patch('queue_fetcher.tasks.base.time.time')
+    def test_max_lifetime(self, _time):
+        """The worker stops after max_lifetime seconds.
+        """
+        _time.side_effect = [100, 110, 130]
+        task = VisibilityTask()
+        task.max_lifetime = 30
+
+        with patch.object(task, '_run') as _run:
+            task.run()
+
+        self.assertEqual(_run.call_count, 2)
+
+    @patch('queue_fetcher.tasks.base.get_rss', return_value=2048)
+    def test_max_rss(self, _get_rss):
+        """The worker stops when its memory use is too high.
+        """
+        task = VisibilityTask()
+        task.max_rss = 1024
+
+        with patch.object(task, '_run') as _run:
+            task.run()
+
+        self.assertEqual(_run.call_count, 1)
+
+
+@override_settings(TEST_SQS=False)
+class DelayTestCase(TestCase):
+    """Test messages delayed for longer than SQS supports.
+    """
+
+    def get_message(self, deliver_at):
+        message = MagicMock()
+        message.body = '[{"message_type": "sample"}]'
+        message.message_attributes = {
+            'message_type': {'DataType': 'String', 'StringValue': 'sample'},
+            'deliver_at': {'DataType': 'Number',
+                           'StringValue': str(deliver_at)},
+        }
+        return message
+
+    def test_requeued(self):
+        """Messages not yet due are sent again with the remaining delay.
+        """
+        queue = MagicMock()
+        message = self.get_message(time.time() + 1000)
+
+        task = VisibilityTask()
+        self.assertEqual(task._handle_message(message, queue), 'delayed')
+
+        _args, kwargs = queue.send_message.call_args
+        self.assertEqual(kwargs['MessageBody'], message.body)
+        self.assertEqual(kwargs['DelaySeconds'], 900)
+        self.assertEqual(kwargs['MessageAttributes']['message_type'],
+                         message.message_attributes['message_type'])
+        self.assertTrue(message.delete.called)
+
+    def test_hidden(self):
+        """Without the queue, messages are hidden until due.
+        """
+        message = self.get_message(time.time() + 100)
+
+        task = VisibilityTask()
+        self.assertEqual(task._handle_message(message), 'delayed')
+
+        _args, kwargs = message.change_visibility.call_args
+        self.assertIn(kwargs['VisibilityTimeout'], (99, 100))
+
+    def test_due(self):
+        """Due messages are processed.
+        """
+        message = self.get_message(time.time() - 1)
+
+        task = VisibilityTask()
+        self.assertEqual(task._handle_message(message), 'processed')
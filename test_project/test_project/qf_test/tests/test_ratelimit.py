@@ -0,0 +1,231 @@
+"""Test rate and concurrency limits on message types.
+"""
+from mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from test_project.qf_test.tasks.queues import LimitedTask
+from queue_fetcher.utils.ratelimit import RateLimit, TokenBucket
+
+
+class TokenBucketTestCase(TestCase):
+    """Test the in-process token bucket.
+    """
+
+    @patch('queue_fetcher.utils.ratelimit.time.time')
+    def test_refill(self, _time):
+        """Tokens refill at the configured rate.
+        """
+        _time.return_value = 100
+        bucket = TokenBucket(2)
+
+        self.assertTrue(bucket.acquire(2))
+        self.assertFalse(bucket.acquire())
+
+        _time.return_value = 100.5
+        self.assertTrue(bucket.acquire())
+        self.assertFalse(bucket.acquire())
+
+    @patch('queue_fetcher.utils.ratelimit.time.time')
+    def test_over_burst(self, _time):
+        """Requests larger than the burst wait for a full bucket and leave it
+        in debt.
+        """
+        _time.return_value = 100
+        bucket = TokenBucket(2)
+
+        self.assertTrue(bucket.acquire(4))
+
+        _time.return_value = 101
+        self.assertFalse(bucket.acquire())
+
+        _time.return_value = 102
+        self.assertTrue(bucket.acquire(2))
+
+    @patch('queue_fetcher.utils.ratelimit.time.time', return_value=100)
+    def test_refund(self, _time):
+        """Refunded tokens can be taken again.
+        """
+        bucket = TokenBucket(2)
+
+        self.assertTrue(bucket.acquire(2))
+        bucket.refund(2)
+        self.assertTrue(bucket.acquire(2))
+
+
+class RateLimitTestCase(TestCase):
+    """Test the combined limits.
+    """
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_concurrency(self):
+        """Slots are handed back on release.
+        """
+        limit = RateLimit('test', concurrency=1)
+        lease = limit.acquire()
+        self.assertTrue(lease)
+        self.assertFalse(limit.acquire())
+        limit.release(lease)
+        self.assertTrue(limit.acquire())
+
+    def test_shared_concurrency(self):
+        """Limits using the cache are shared between instances.
+        """
+        first = RateLimit('test', concurrency=1, cache='default')
+        second = RateLimit('test', concurrency=1, cache='default')
+
+        lease = first.acquire()
+        self.assertTrue(lease)
+        self.assertFalse(second.acquire())
+        first.release(lease)
+        self.assertTrue(second.acquire())
+
+    @patch('queue_fetcher.utils.ratelimit.time.time', return_value=100)
+    def test_shared_rate(self, _time):
+        """Rates using the cache are shared between instances.
+        """
+        first = RateLimit('test', rate=2, cache='default')
+        second = RateLimit('test', rate=2, cache='default')
+
+        self.assertTrue(first.acquire())
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.acquire())
+
+    @patch('queue_fetcher.utils.ratelimit.time.time')
+    def test_shared_sustained_rate(self, _time):
+        """The shared limit allows the burst, then holds to the rate.
+        """
+        limit = RateLimit('test', rate=5, burst=10, cache='default')
+
+        _time.return_value = 100
+        self.assertTrue(limit.acquire(10))
+        _time.return_value = 101
+        self.assertFalse(limit.acquire())
+        _time.return_value = 102
+        self.assertTrue(limit.acquire(10))
+
+    @patch('queue_fetcher.utils.ratelimit.time.time')
+    def test_shared_over_burst(self, _time):
+        """Shared requests larger than the burst use up the next windows.
+        """
+        limit = RateLimit('test', rate=2, cache='default')
+
+        _time.return_value = 100
+        self.assertTrue(limit.acquire(5))
+        _time.return_value = 101
+        self.assertFalse(limit.acquire())
+        _time.return_value = 102
+        self.assertTrue(limit.acquire())
+        self.assertFalse(limit.acquire())
+
+    @patch('time.time')
+    def test_shared_lease_expires(self, _time):
+        """A slot held by a worker that died is free once its lease expires.
+        """
+        _time.return_value = 100
+        limit = RateLimit('test', concurrency=1, cache='default',
+                          lease_timeout=60)
+
+        dead = limit.acquire()
+        self.assertTrue(dead)
+        self.assertFalse(limit.acquire())
+
+        _time.return_value = 161
+        lease = limit.acquire()
+        self.assertTrue(lease)
+
+        limit.release(dead)
+        self.assertFalse(limit.acquire())
+        limit.release(lease)
+        self.assertTrue(limit.acquire())
+
+    def test_shared_release_evicted(self):
+        """Releasing a slot that was evicted does not raise.
+        """
+        limit = RateLimit('test', concurrency=1, cache='default')
+
+        lease = limit.acquire()
+        cache.clear()
+        limit.release(lease)
+        self.assertTrue(limit.acquire())
+
+    def test_lease_timeout(self):
+        """Shared slots are leased for the visibility timeout or deadline.
+        """
+        task = LimitedTask()
+        task.rate_limit_cache = 'default'
+        task.visibility_timeout = 300
+        task.deadlines = {'slow': 900}
+
+        limit = task._get_rate_limit('slow')
+        self.assertEqual(limit.semaphore.timeout, 900)
+
+
+class LimitedTaskTestCase(TestCase):
+    """Test QueueFetcher defers messages over their limits.
+    """
+
+    def test_read_within_limit(self):
+        """Messages within the limit are processed.
+        """
+        task = LimitedTask()
+        self.assertTrue(task.read([{'message_type': 'sample'}] * 2))
+
+    def test_read_over_limit(self):
+        """Messages over the limit are not processed.
+        """
+        task = LimitedTask()
+        self.assertTrue(task.read([{'message_type': 'sample'}] * 2))
+        self.assertFalse(task.read({'message_type': 'sample'}))
+
+    @patch('queue_fetcher.utils.ratelimit.time.time')
+    def test_read_over_burst(self, _time):
+        """Messages with more events than the burst are still processed.
+        """
+        _time.return_value = 100
+        task = LimitedTask()
+
+        self.assertTrue(task.read([{'message_type': 'sample'}] * 3))
+        self.assertFalse(task.read({'message_type': 'sample'}))
+
+        _time.return_value = 102
+        self.assertTrue(task.read({'message_type': 'sample'}))
+
+    def test_refund_on_later_type(self):
+        """Tokens taken for one type are refunded if a later type is over its
+        limit.
+        """
+        task = LimitedTask()
+        self.assertTrue(task.read({'message_type': 'slow'}))
+
+        limit = task._get_rate_limit('slow')
+        lease = limit.acquire()
+        self.assertTrue(lease)
+        self.assertFalse(task.read([{'message_type': 'sample'},
+                                    {'message_type': 'slow'}]))
+        limit.release(lease)
+
+        self.assertTrue(task.read([{'message_type': 'sample'}] * 2))
+
+    def test_deferred(self):
+        """Over-limit messages have their visibility extended.
+        """
+        task = LimitedTask()
+        task.read([{'message_type': 'sample'}] * 2)
+        message = MagicMock()
+        message.body = {'message_type': 'sample'}
+
+        task._handle_message(message)
+
+        message.change_visibility.assert_called_with(VisibilityTimeout=30)
+        self.assertFalse(message.delete.called)
+
+    def test_concurrency_released(self):
+        """Concurrency slots are released after each message.
+        """
+        task = LimitedTask()
+        self.assertTrue(task.read({'message_type': 'slow'}))
+        self.assertTrue(task.read({'message_type': 'slow'}))
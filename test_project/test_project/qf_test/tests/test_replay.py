@@ -0,0 +1,74 @@
+"""Test replaying captured messages.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from queue_fetcher.utils.transfer import open_jsonl
+
+
+class ReplayTestCase(TransactionTestCase):
+    """Test the replay_queue command.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'capture.jsonl.gz')
+        with open_jsonl(self.path, 'w') as fd:
+            for name in ('alice', 'bob', 'carol'):
+                body = json.dumps([{'message_type': 'user', 'name': name}])
+                fd.write(json.dumps({'body': body}) + '\n')
+            fd.write(json.dumps({'body': '[{"message_type": "missing"}]'}) +
+                     '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def replay(self, **kwargs):
+        stdout = io.StringIO()
+        call_command('replay_queue', 'qf_test.UserTask', self.path,
+                     stdout=stdout, stderr=io.StringIO(), **kwargs)
+        return stdout.getvalue()
+
+    def test_replay(self):
+        """Messages are processed and reported.
+        """
+        output = self.replay()
+
+        self.assertEqual(
+            sorted(User.objects.values_list('username', flat=True)),
+            ['alice', 'bob', 'carol'])
+        self.assertIn('process_user', output)
+        self.assertIn('Replayed 4 messages, 1 failed', output)
+
+    def test_dry_run(self):
+        """Dry runs are rolled back.
+        """
+        output = self.replay(dry_run=True)
+
+        self.assertFalse(User.objects.exists())
+        self.assertIn('Replayed 4 messages, 1 failed', output)
+
+    def test_limit(self):
+        """Replays stop at the limit.
+        """
+        self.replay(limit=2)
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_workers(self):
+        """Messages can be replayed in parallel.
+
+        SQLite's in-memory test database locks on concurrent writes, so the
+        handler doesn't write here.
+        """
+        with patch('test_project.qf_test.tasks.queues.UserTask.process_user'):
+            output = self.replay(workers=2)
+        self.assertIn('Replayed 4 messages, 1 failed', output)
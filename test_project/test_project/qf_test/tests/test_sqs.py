@@ -1,10 +1,16 @@
 import json
+import subprocess
+import sys
+import threading
+from datetime import timedelta
 
 from mock import patch
 
+from django.conf import settings
 from django.test import TestCase, override_settings
+from django.utils import timezone
 
-from queue_fetcher.utils import sqs
+from queue_fetcher.utils import attributes, sqs
 
 
 class SQSTestCase(TestCase):
@@ -144,11 +150,170 @@ class SQSProductionTestCase(TestCase):
         _args, cwargs = mock_queue.send_message.call_args
         self.assertEqual(cwargs['MessageBody'], message)
 
-    @patch('boto3.resource')
-    def test_arn(self, resource):
+    @patch('queue_fetcher.utils.sqs.get_queue')
+    def test_sqs_attributes(self, mock_queue):
+        """The message types are sent as a message attribute.
+        """
+        message = [
+            {'message_type': 'demo'},
+            {'message_type': 'other'},
+            {'message_type': 'demo'},
+        ]
+
+        sqs.send_message(mock_queue, message, attributes={'priority': 2})
+
+        _args, cwargs = mock_queue.send_message.call_args
+        self.assertEqual(cwargs['MessageAttributes'], {
+            'message_type': {'DataType': 'String',
+                             'StringValue': 'demo,other'},
+            'priority': {'DataType': 'Number', 'StringValue': '2'},
+        })
+
+    @patch('queue_fetcher.utils.sqs.get_queue')
+    def test_delay(self, mock_queue):
+        """Short delays use DelaySeconds.
+        """
+        sqs.send_message(mock_queue, [], delay=timedelta(seconds=60))
+
+        _args, cwargs = mock_queue.send_message.call_args
+        self.assertEqual(cwargs['DelaySeconds'], 60)
+        self.assertNotIn('MessageAttributes', cwargs)
+
+    @patch('queue_fetcher.utils.sqs.time.time', return_value=1000)
+    @patch('queue_fetcher.utils.sqs.get_queue')
+    def test_long_delay(self, mock_queue, _time):
+        """Long delays also send the time the message is due.
+        """
+        sqs.send_message(mock_queue, [], delay=3600)
+
+        _args, cwargs = mock_queue.send_message.call_args
+        self.assertEqual(cwargs['DelaySeconds'], 900)
+        self.assertEqual(cwargs['MessageAttributes']['deliver_at'],
+                         {'DataType': 'Number', 'StringValue': '4600'})
+
+    @patch('queue_fetcher.utils.sqs.get_queue')
+    def test_send_at(self, mock_queue):
+        """Messages can be sent for delivery at a given time.
+        """
+        sqs.send_at(mock_queue, [], timezone.now() + timedelta(minutes=5))
+
+        _args, cwargs = mock_queue.send_message.call_args
+        self.assertIn(cwargs['DelaySeconds'], (299, 300))
+
+    @patch('queue_fetcher.utils.sqs._local', threading.local())
+    @patch('boto3.session.Session')
+    def test_arn(self, session):
         """Test if using an ARN works
         """
+        resource = session.return_value.resource
         sqs.get_queue('arn:aws:sqs:nowhere:4444455556666:queuenamehere')
         resource.assert_called_with('sqs', region_name='nowhere')
         resource.return_value.get_queue_by_name.assert_called_with(
             QueueName='queuenamehere', QueueOwnerAWSAccountId='4444455556666')
+
+
+class AttributesTestCase(TestCase):
+    """Test converting message attributes.
+    """
+
+    def test_round_trip(self):
+        """Attributes decode to the values they were encoded from.
+        """
+        values = {'message_type': 'demo', 'count': 3, 'ratio': 0.5}
+        self.assertEqual(
+            attributes.decode_attributes(
+                attributes.encode_attributes(values)),
+            values)
+
+    def test_round_trip_exponent(self):
+        """Numbers written with an exponent decode.
+        """
+        values = {'small': 1e-05, 'large': 1e20, 'count': 10}
+        self.assertEqual(
+            attributes.decode_attributes(
+                attributes.encode_attributes(values)),
+            values)
+
+    def test_bad_attribute(self):
+        """Attributes that can't be decoded are left out.
+        """
+        self.assertEqual(
+            attributes.decode_attributes({
+                'weight': {'DataType': 'Number', 'StringValue': 'heavy'},
+                'missing': {'DataType': 'Number'},
+                'message_type': {'DataType': 'String',
+                                 'StringValue': 'demo'},
+            }),
+            {'message_type': 'demo'})
+
+    def test_nested_message_types(self):
+        """Events in nested lists have their message_type found.
+        """
+        self.assertEqual(
+            attributes.message_types([
+                {'message_type': 'other'},
+                [{'message_type': 'sample'}, {'message_type': 'other'}],
+            ]),
+            ['other', 'sample'])
+
+    def test_too_many(self):
+        """SQS only allows 10 attributes.
+        """
+        with self.assertRaises(ValueError):
+            attributes.encode_attributes({str(i): i for i in range(11)})
+
+
+class LazyBotoTestCase(TestCase):
+    """Test boto3 is only imported when it's needed.
+    """
+
+    def test_not_imported(self):
+        """Importing the tasks doesn't import boto3.
+        """
+        code = ('import sys, django; django.setup(); '
+                'import queue_fetcher.tasks, queue_fetcher.test; '
+                'from queue_fetcher.utils import sqs; sqs.get_queue("test"); '
+                'print("boto3" in sys.modules)')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=settings.BASE_DIR)
+        self.assertEqual(output.strip(), b'False')
+
+    @patch('queue_fetcher.utils.sqs._local', threading.local())
+    @patch('boto3.session.Session')
+    def test_warm_up(self, session):
+        """Resources are created once per region.
+        """
+        resource = session.return_value.resource
+        sqs.warm_up(['eu-west-1', 'us-east-1'])
+        sqs.warm_up(['eu-west-1'])
+
+        self.assertEqual(resource.call_count, 2)
+        resource.assert_called_with('sqs', region_name='us-east-1')
+
+    @patch('queue_fetcher.utils.sqs._local', threading.local())
+    @patch('boto3.session.Session')
+    def test_resource_per_thread(self, session):
+        """Each thread gets its own resource.
+        """
+        session.return_value.resource.side_effect = (
+            lambda *args, **kwargs: object())
+        resources = []
+
+        def look_up():
+            resources.append(sqs._get_resource('eu-west-1'))
+            resources.append(sqs._get_resource('eu-west-1'))
+
+        look_up()
+        thread = threading.Thread(target=look_up)
+        thread.start()
+        thread.join()
+
+        self.assertIs(resources[0], resources[1])
+        self.assertIs(resources[2], resources[3])
+        self.assertIsNot(resources[0], resources[2])
+
+    def test_thread_queue_mock(self):
+        """Mock queues are shared between threads.
+        """
+        queue = sqs.get_queue('test')
+        self.assertIs(sqs.thread_queue(queue), queue)
@@ -0,0 +1,98 @@
+"""Test shedding stale messages.
+"""
+import time
+
+from django.test import TransactionTestCase
+
+from test_project.qf_test.tasks.queues import StaleTask
+from queue_fetcher.utils import sqs
+
+
+class StaleTaskTestCase(TransactionTestCase):
+    """Test messages older than their max_age are shed.
+
+    Parked events are sent on commit, so this needs real transactions.
+    """
+
+    def setUp(self):
+        sqs.clear_outbox()
+        self.queue = sqs.get_queue('test')
+        self.queue.receive_messages()
+        self.old = time.time() - 120
+
+    def run_task(self):
+        task = StaleTask()
+        task.run_once()
+        return task
+
+    def test_fresh(self):
+        """Fresh messages are processed as usual.
+        """
+        self.queue.add_message([
+            {'message_type': 'sample'},
+            {'message_type': 'audit'},
+            {'message_type': 'report'},
+        ])
+        self.assertEqual(self.run_task().seen,
+                         ['sample', 'audit', 'report'])
+
+    def test_drop_before_decode(self):
+        """Stale messages are dropped using their attributes alone.
+        """
+        self.queue.add_message('not json', {'message_type': 'sample'},
+                               sent_at=self.old)
+        self.assertEqual(self.run_task().seen, [])
+
+    def test_park_before_decode(self):
+        """Stale messages are parked using their attributes alone.
+        """
+        self.queue.add_message('[{"message_type": "audit"}]',
+                               {'message_type': 'audit'}, sent_at=self.old)
+        self.assertEqual(self.run_task().seen, [])
+        self.assertEqual(sqs.outbox['park'], [[{'message_type': 'audit'}]])
+
+    def test_each_event(self):
+        """Mixed messages have a policy applied to each event.
+        """
+        self.queue.add_message([
+            {'message_type': 'sample'},
+            {'message_type': 'audit', 'id': 1},
+            {'message_type': 'report'},
+        ], sent_at=self.old)
+
+        self.assertEqual(self.run_task().seen, ['stale_report'])
+        self.assertEqual(sqs.outbox['park'],
+                         [[{'message_type': 'audit', 'id': 1}]])
+
+    def test_park_together(self):
+        """Events parked from one message are sent as one message.
+        """
+        self.queue.add_message([
+            {'message_type': 'audit', 'id': 1},
+            {'message_type': 'sample'},
+            {'message_type': 'audit', 'id': 2},
+        ], sent_at=self.old)
+        self.run_task()
+
+        self.assertEqual(sqs.outbox['park'], [[
+            {'message_type': 'audit', 'id': 1},
+            {'message_type': 'audit', 'id': 2},
+        ]])
+
+    def test_park_rolled_back(self):
+        """Nothing is parked if the message fails.
+        """
+        self.queue.add_message([
+            {'message_type': 'audit', 'id': 1},
+            {'message_type': 'unknown'},
+        ], sent_at=self.old)
+        self.run_task()
+
+        self.assertFalse(sqs.outbox.get('park'))
+
+    def test_no_age(self):
+        """Messages read directly are never stale.
+        """
+        task = StaleTask()
+        task.read([{'message_type': 'sample'}])
+        self.assertEqual(task.seen, ['sample'])
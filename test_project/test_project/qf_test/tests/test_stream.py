@@ -0,0 +1,83 @@
+"""Test incremental decoding of list messages.
+"""
+import json
+
+from mock import patch
+
+from django.test import TestCase
+
+from test_project.qf_test.tasks.queues import StreamingTask
+from queue_fetcher.utils.stream import chunked, iter_json_array
+
+
+class IterJsonArrayTestCase(TestCase):
+    """Test decoding JSON arrays an item at a time.
+    """
+
+    def test_array(self):
+        """Each item is yielded in turn.
+        """
+        items = [{'a': [1, 2]}, 'text', 3, None, [{'b': ']'}]]
+        self.assertEqual(
+            list(iter_json_array(json.dumps(items, indent=2))), items)
+
+    def test_empty(self):
+        """An empty array yields nothing.
+        """
+        self.assertEqual(list(iter_json_array(' [ ] ')), [])
+
+    def test_object(self):
+        """A single object is yielded whole.
+        """
+        self.assertEqual(list(iter_json_array('{"a": 1}')), [{'a': 1}])
+
+    def test_invalid(self):
+        """Malformed arrays raise ValueError.
+        """
+        for text in ('[1 2]', '[1, 2', '[1] 2'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(text))
+
+    def test_chunked(self):
+        """Items are grouped into lists.
+        """
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+class StreamingTaskTestCase(TestCase):
+    """Test QueueFetcher with stream_decode set.
+    """
+
+    def get_message(self, *tests):
+        return json.dumps([{'message_type': 'sample', 'test': test}
+                           for test in tests])
+
+    def test_read(self):
+        """Events are processed in chunks.
+        """
+        task = StreamingTask()
+        self.assertTrue(task.read(self.get_message('a', 'b', 'c')))
+        self.assertEqual(task.chunks, [2, 1])
+
+    def test_failure(self):
+        """A failing event fails the message.
+        """
+        task = StreamingTask()
+        self.assertFalse(task.read(self.get_message('a', 'b', 'fail')))
+
+    def test_single_transaction(self):
+        """The message is processed in one transaction by default.
+        """
+        task = StreamingTask()
+        with patch('queue_fetcher.tasks.base.transaction') as _transaction:
+            task.read(self.get_message('a', 'b', 'c'))
+        self.assertEqual(_transaction.atomic.call_count, 1)
+
+    def test_commit_chunks(self):
+        """Each chunk can be committed separately.
+        """
+        task = StreamingTask()
+        task.stream_commit_chunks = True
+        with patch('queue_fetcher.tasks.base.transaction') as _transaction:
+            task.read(self.get_message('a', 'b', 'c'))
+        self.assertEqual(_transaction.atomic.call_count, 2)
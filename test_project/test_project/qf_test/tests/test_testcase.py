@@ -0,0 +1,90 @@
+"""Test the QueueTestCase helpers.
+"""
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.test import override_settings
+
+from test_project.qf_test.tasks.queues import MultiTask
+from queue_fetcher.test import QueueTestCase
+from queue_fetcher.utils import sqs
+
+
+class QueueTestCaseTestCase(QueueTestCase):
+    """Test fixture caching and the outbox helpers.
+    """
+
+    def setUp(self):
+        super(QueueTestCaseTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'app', 'fixtures', 'app'))
+        self.settings = override_settings(BASE_DIR=self.tmpdir)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def write_fixture(self, name, content, mtime=1000):
+        path = os.path.join(self.tmpdir, 'app', 'fixtures', 'app', name)
+        with open(path, 'w') as fd:
+            fd.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def test_json_cached(self):
+        """JSON fixtures are only read and parsed once.
+        """
+        self.write_fixture('cached.json', '[{"message_type": "sample"}]')
+        first = self.get_json('app/cached.json')
+        first[0]['changed'] = True
+
+        with patch.object(self, 'get_fixture') as _get_fixture:
+            second = self.get_json('app/cached.json')
+
+        self.assertFalse(_get_fixture.called)
+        self.assertEqual(second, [{'message_type': 'sample'}])
+
+    def test_modified(self):
+        """Fixtures are parsed again when they change.
+        """
+        self.write_fixture('changed.json', '{"a": 1}')
+        self.assertEqual(self.get_json('app/changed.json'), {'a': 1})
+
+        self.write_fixture('changed.json', '{"a": 2}', mtime=2000)
+        self.assertEqual(self.get_json('app/changed.json'), {'a': 2})
+
+    def test_yaml(self):
+        """YAML fixtures are parsed.
+        """
+        self.write_fixture('test.yaml', '- message_type: sample\n')
+        self.assertEqual(self.get_yaml('app/test.yaml'),
+                         [{'message_type': 'sample'}])
+
+    def test_outbox(self):
+        """Sent messages can be asserted on.
+        """
+        self.assertNoMessagesSent()
+        sqs.queue_send('test', [{'message_type': 'sample', 'test': 'hi'}])
+
+        self.assertMessageSent('test', count=1, message_type='sample')
+        self.assertMessageSent(
+            'test', message=[{'message_type': 'sample', 'test': 'hi'}])
+        self.assertNoMessagesSent('other')
+        with self.assertRaises(AssertionError):
+            self.assertNoMessagesSent()
+
+    def test_isolated(self):
+        """The outbox and queues start empty.
+        """
+        sqs.outbox['leaked'] = [{}]
+        self.add_message('test', {'message_type': 'sample', 'test': 'hi'})
+
+        QueueTestCase.setUp(self)
+
+        self.assertNoMessagesSent()
+        task = MultiTask()
+        task.run_once()
+        self.assertEqual(task.seen, [])
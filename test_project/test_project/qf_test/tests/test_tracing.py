@@ -0,0 +1,114 @@
+"""Test trace context propagation.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock
+
+from django.test import TestCase, override_settings
+
+from test_project.qf_test.tasks.queues import VisibilityTask
+from queue_fetcher.utils import sqs
+from queue_fetcher.utils.mock_sqs import MockMessage
+from queue_fetcher.utils.tracing import Tracer, get_tracer
+
+
+class NullTracerTestCase(TestCase):
+    """Test the default tracer.
+    """
+
+    def test_default(self):
+        """Nothing is traced by default.
+        """
+        tracer = get_tracer()
+        self.assertEqual(type(tracer), Tracer)
+        self.assertEqual(tracer.inject(), {})
+
+
+class JSONFileTracerTestCase(TestCase):
+    """Test tracing messages to a file.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'trace.jsonl')
+        self.settings = override_settings(
+            TEST_SQS=False,
+            QUEUE_FETCHER_TRACER='queue_fetcher.utils.tracing.JSONFileTracer',
+            QUEUE_FETCHER_TRACE_FILE=self.path)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def get_spans(self):
+        get_tracer().flush()
+        with open(self.path) as fd:
+            return [json.loads(line) for line in fd]
+
+    def test_propagation(self):
+        """The consumer's spans continue the sender's trace.
+        """
+        queue = MagicMock()
+        with get_tracer().span('request'):
+            sqs.send_message(queue, [{'message_type': 'sample'}])
+        _args, kwargs = queue.send_message.call_args
+
+        message = MockMessage(kwargs['MessageBody'],
+                              kwargs['MessageAttributes'])
+        VisibilityTask()._handle_message(message)
+
+        request, handler, read = self.get_spans()
+        self.assertEqual(request['name'], 'request')
+        sent = kwargs['MessageAttributes']
+        self.assertEqual(read['name'], 'read')
+        self.assertEqual(read['trace_id'], sent['trace_id']['StringValue'])
+        self.assertEqual(read['parent_id'], sent['span_id']['StringValue'])
+        self.assertGreaterEqual(read['attributes']['queue_wait'], 0)
+        self.assertEqual(read['attributes']['task'], 'VisibilityTask')
+
+        self.assertEqual(handler['name'], 'process_sample')
+        self.assertEqual(handler['trace_id'], read['trace_id'])
+        self.assertEqual(handler['parent_id'], read['span_id'])
+
+    def test_no_sender_span(self):
+        """Messages sent outside a span start a trace with no parent.
+        """
+        queue = MagicMock()
+        sqs.send_message(queue, [{'message_type': 'sample'}])
+        _args, kwargs = queue.send_message.call_args
+
+        self.assertIn('trace_id', kwargs['MessageAttributes'])
+        self.assertNotIn('span_id', kwargs['MessageAttributes'])
+
+        message = MockMessage(kwargs['MessageBody'],
+                              kwargs['MessageAttributes'])
+        VisibilityTask()._handle_message(message)
+
+        _handler, read = self.get_spans()
+        self.assertIsNone(read['parent_id'])
+
+    def test_buffered(self):
+        """Spans are buffered between flushes.
+        """
+        tracer = get_tracer()
+        tracer.flush_interval = 60
+        tracer.flush()
+
+        VisibilityTask().read({'message_type': 'sample'})
+
+        with open(self.path) as fd:
+            self.assertEqual(fd.read(), '')
+        self.assertEqual(len(self.get_spans()), 2)
+
+    def test_error(self):
+        """Failed messages are marked on the span.
+        """
+        VisibilityTask().read({'message_type': 'unknown'})
+
+        read, = self.get_spans()
+        self.assertIn('error', read['attributes'])
+        self.assertIsNone(read['parent_id'])
@@ -0,0 +1,163 @@
+"""Test the queue export, import and redrive commands.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from queue_fetcher.utils import sqs
+from queue_fetcher.utils.mock_sqs import MockMessage
+from queue_fetcher.utils.transfer import (Progress, Receiver, dump_record,
+                                          load_record, open_jsonl,
+                                          read_records, send_batch)
+
+
+class TransferTestCase(TestCase):
+    """Test moving messages in bulk.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = sqs.get_queue('test')
+        self.other = sqs.get_queue('other')
+        self.queue.receive_messages()
+        self.other.receive_messages()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def add_messages(self, count):
+        for index in range(count):
+            self.queue.add_message(json.dumps({'index': index}),
+                                   {'message_type': 'sample'})
+
+    def write_records(self, path, count):
+        with open_jsonl(path, 'w') as fd:
+            for index in range(count):
+                fd.write(json.dumps({'body': str(index)}) + '\n')
+
+    def test_export(self):
+        """Messages are written to a gzipped file.
+        """
+        self.add_messages(25)
+        path = self.get_path('export.jsonl.gz')
+
+        call_command('export_queue', 'test', path, workers=3, delete=True,
+                     stdout=io.StringIO())
+
+        records = list(read_records(path))
+        self.assertEqual(
+            sorted(json.loads(record['body'])['index'] for record in records),
+            list(range(25)))
+        self.assertEqual(
+            records[0]['message_attributes']['message_type']['StringValue'],
+            'sample')
+
+    def test_export_limit(self):
+        """Exports stop at the limit.
+        """
+        self.add_messages(25)
+        path = self.get_path('export.jsonl')
+
+        call_command('export_queue', 'test', path, limit=12,
+                     stdout=io.StringIO())
+
+        self.assertEqual(len(list(read_records(path))), 12)
+
+    def test_receive_unique(self):
+        """Messages received again after their visibility timeout are only
+        passed on once.
+        """
+        messages = [MockMessage(str(index)) for index in range(3)]
+        queue = MagicMock()
+        queue.receive_messages.return_value = messages
+        received = []
+
+        receiver = Receiver(queue, received.extend, workers=2, unique=True)
+
+        self.assertEqual(receiver.run(), 3)
+        self.assertEqual(sorted(message.body for message in received),
+                         ['0', '1', '2'])
+
+    def test_send_batch_size(self):
+        """Batches too large for one request are split by size.
+        """
+        queue = MagicMock()
+        queue.send_messages.return_value = {}
+        body = 'x' * 100000
+
+        send_batch(queue, [{'body': body}] * 3)
+
+        self.assertEqual(
+            [len(call[1]['Entries'])
+             for call in queue.send_messages.call_args_list],
+            [2, 1])
+
+    def test_binary_attributes(self):
+        """Binary attributes are base64-encoded in files.
+        """
+        record = {'body': '[]', 'message_attributes': {
+            'blob': {'DataType': 'Binary', 'BinaryValue': b'\x00\xff'}}}
+
+        line = dump_record(record)
+
+        self.assertIn('AP8=', line)
+        self.assertEqual(load_record(line), record)
+
+    def test_import(self):
+        """Records are sent in batches and progress saved.
+        """
+        path = self.get_path('import.jsonl')
+        progress = self.get_path('progress')
+        self.write_records(path, 25)
+
+        call_command('import_queue', path, 'other', workers=3,
+                     progress=progress, stdout=io.StringIO())
+
+        self.assertEqual(len(self.other._inbox), 25)
+        with open(progress) as fd:
+            self.assertEqual(fd.read(), '25')
+
+    def test_import_resume(self):
+        """Imports carry on from their saved progress.
+        """
+        path = self.get_path('import.jsonl.gz')
+        progress = self.get_path('progress')
+        self.write_records(path, 25)
+        with open(progress, 'w') as fd:
+            fd.write('20')
+
+        call_command('import_queue', path, 'other', progress=progress,
+                     stdout=io.StringIO())
+
+        self.assertEqual(sorted(message.body for message in self.other._inbox),
+                         ['20', '21', '22', '23', '24'])
+
+    def test_redrive(self):
+        """Messages are moved between queues.
+        """
+        self.add_messages(25)
+
+        call_command('redrive_queue', 'test', 'other', limit=12,
+                     stdout=io.StringIO())
+
+        self.assertEqual(len(self.other._inbox), 12)
+        self.assertEqual(len(self.queue._inbox), 13)
+
+    def test_progress(self):
+        """Progress only counts batches with no gaps before them.
+        """
+        progress = Progress()
+        progress.finish(10, 10)
+        self.assertEqual(progress.done, 0)
+        progress.finish(0, 10)
+        self.assertEqual(progress.done, 20)
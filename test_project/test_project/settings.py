@@ -131,5 +131,7 @@ STATIC_URL = '/static/'
 TEST_SQS = True
 
 QUEUES = {
-    'test': 'test'
+    'test': 'test',
+    'other': 'other',
+    'park': 'park',
 }